@@ -19,28 +19,28 @@ class IfDef(Void):
 
 
 class YipNode(BaseMeta):
-    pass
+    __slots__ = ()
 
 
 class DictNode(YipNode, dict):
+    __slots__ = ('meta',)
+
     def __init__(self, it=None, *a, **kw):
-        if isinstance(it, DictNode):
-            self.meta = it.meta
-        else:
-            self.meta = None
-            if it is None:
-                a = tuple()
-            else:
-                a = [it] + list(a)
+        self.meta = it.meta if isinstance(it, DictNode) else None
+        if it is not None:
+            a = (it,) + a
         dict.__init__(self, *a, **kw)
 
 
 class ListNode(YipNode, list):
+    __slots__ = ('meta',)
+
     def __init__(self, *a, **kw):
         self.meta = None
         list.__init__(self, *a, **kw)
 
 
+# str subclasses can't have slots
 class StrNode(YipNode, str):
     def __str__(self):
         return self
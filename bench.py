@@ -0,0 +1,253 @@
+#!/bin/python
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import tracemalloc
+from profiling import Timings
+from yiptable import Yip
+
+_default_scales = (1000, 10000, 100000, 1000000)
+
+
+class ConfigGenerator():
+    # rules produced by each service file
+    addr_loop = 60
+    port_loop = 30
+    plain_rules = 6
+    depth = 6
+    services_per_group = 20
+    global_vars = 200
+
+    def __init__(self, root, rules, seed=0):
+        self.root = root
+        self.rules = rules
+        self.random = random.Random(seed)
+
+    @property
+    def rules_per_service(self):
+        return self.addr_loop + self.port_loop + self.plain_rules + 2
+
+    def write(self, name, lines):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def address(self):
+        r = self.random.getrandbits(32)
+        return f'{r >> 24 & 0xff}.{r >> 16 & 0xff}.{r >> 8 & 0xff}.{r & 0xff}'
+
+    def gen_common(self):
+        self.write('common.yml', [
+            '- target: ACCEPT established {svc_name}',
+            '  state: [RELATED, ESTABLISHED]',
+            '- target: DROP invalid {svc_name}',
+            '  state: INVALID',
+        ])
+
+    def gen_service(self, sid):
+        lines = []
+        ind = ''
+        for level in range(self.depth):
+            lines += [
+                f'{ind}- block:',
+                f'{ind}    level{level}: "{{svc_name}}-{level}"',
+            ]
+            if level == 0:
+                lines += [f'{ind}    !rule chain: FORWARD']
+            if level == 1:
+                lines += [f'{ind}    !rule proto: tcp']
+            lines += [f'{ind}  rules:']
+            ind += '    '
+
+        lines += [
+            f'{ind}- target: ACCEPT {{level{self.depth - 1}}} from {{item}}',
+            f"{ind}  saddr: '{{item}}'",
+            f"{ind}  dport: '{{svc_port}}'",
+            f'{ind}  with_items:',
+        ]
+        lines += [
+            f'{ind}    - {self.address()}/32' for i in range(self.addr_loop)
+        ]
+        lines += [
+            f'{ind}- target: ACCEPT port {{item}}',
+            f"{ind}  dport: '{{item}}'",
+            f"{ind}  daddr: '{{svc_addr}}'",
+            f'{ind}  with_items:',
+        ]
+        lines += [
+            f'{ind}    - {1024 + sid % 1000 + i}' for i in range(self.port_loop)
+        ]
+        for i in range(self.plain_rules):
+            lines += [
+                f'{ind}- target: DROP rule {i} of {{svc_name}}',
+                f"{ind}  iface: 'eth{i}'",
+                f"{ind}  daddr: '{{v{i % self.global_vars}}}'",
+            ]
+        lines += [
+            f'{ind}- block:',
+            f'{ind}    svc_name: common-{sid}',
+            f'{ind}  rules: !import common.yml',
+        ]
+        self.write(f'service{sid}.yml', lines)
+
+    def gen_group(self, gid, services):
+        lines = []
+        for sid in services:
+            lines += [
+                '- block:',
+                f'    svc_name: service{sid}',
+                f'    svc_port: {sid % 60000 + 1}',
+                f'    svc_addr: {self.address()}',
+                f'  rules: !import service{sid}.yml',
+            ]
+        self.write(f'group{gid}.yml', lines)
+        return f'group{gid}.yml'
+
+    def gen_table(self, name, chains, services):
+        groups = []
+        for i in range(0, len(services), self.services_per_group):
+            groups.append(self.gen_group(
+                f'{name}{len(groups)}',
+                services[i:i + self.services_per_group]
+            ))
+        lines = []
+        for group in groups:
+            lines += [
+                '- block:',
+                '    group: "{table}"',
+                f'  rules: !import {group}',
+            ]
+        self.write(f'{name}.yml', lines)
+        return [
+            f'{name}:',
+            '  chains:',
+        ] + [f'    {c}: ACCEPT' for c in chains] + [
+            f'  rules: !import {name}.yml',
+        ]
+
+    def generate(self):
+        nservices = max(1, round(self.rules / self.rules_per_service))
+        services = list(range(nservices))
+        for sid in services:
+            self.gen_service(sid)
+        self.gen_common()
+
+        lines = ['vars:', '  - table: yip']
+        for i in range(self.global_vars):
+            if i % 4 == 3:
+                lines.append(f"  - v{i}: '{{v{i - 1}}}'")
+            else:
+                lines.append(f'  - v{i}: {self.address()}')
+
+        split = max(1, nservices * 4 // 5)
+        lines += self.gen_table(
+            'filter', ('INPUT', 'FORWARD', 'OUTPUT'), services[:split]
+        )
+        if services[split:]:
+            lines += self.gen_table(
+                'mangle', ('PREROUTING', 'FORWARD'), services[split:]
+            )
+        self.write('main.yml', lines)
+        return os.path.join(self.root, 'main.yml')
+
+
+# times of the phases Yip records, so that the benchmark follows the same
+# build path as the compiler
+def compile_phases(path, compact=False):
+    timings = Timings()
+    yip = Yip(path, compact=compact, timings=timings)
+    with open(os.devnull, 'w') as f:
+        yip.render_to(f)
+    phases = {
+        name: stat[1] for (category, name), stat in timings.stats.items()
+        if category == 'phase'
+    }
+    rules = sum(len(t.rules) for t in yip.tables.values())
+    return phases, rules
+
+
+def peak_memory(path, compact=False):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with open(os.devnull, 'w') as f:
+            Yip(path, compact=compact).render_to(f)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(scale, memory=True, keep=None, seed=0, compact=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = keep if keep else tmp
+        os.makedirs(root, exist_ok=True)
+        path = ConfigGenerator(root, scale, seed).generate()
+        gc.collect()
+        phases, rules = compile_phases(path, compact)
+        result = {
+            'scale': scale,
+            'rules': rules,
+            'files': len(os.listdir(root)),
+            'phases': phases,
+            'total': sum(phases.values()),
+        }
+        if memory:
+            result['peak_memory'] = peak_memory(path, compact)
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='time the compilation of generated rulesets'
+    )
+    parser.add_argument('scales', type=int, nargs='*',
+                        default=_default_scales,
+                        help='number of rules of the generated configs')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the json results to FILE')
+    parser.add_argument('--no-memory', action='store_true',
+                        help="don't measure peak memory usage")
+    parser.add_argument('--keep', metavar='DIR',
+                        help='keep the generated configs in DIR')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compact', action='store_true',
+                        help='compile in compact memory mode')
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        keep = os.path.join(args.keep, str(scale)) if args.keep else None
+        res = run(scale, not args.no_memory, keep, args.seed, args.compact)
+        print(json.dumps(res), file=sys.stderr)
+        results.append(res)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
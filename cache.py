@@ -0,0 +1,79 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'yiptables')
+
+
+def digest(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def read_source(path):
+    with open(path, 'r') as f:
+        content = f.read()
+    return content, digest(content)
+
+
+# parsed trees, keyed by the path and content of the parsed file. Entries
+# also record the digest of every file they imported, and are only used
+# while these are unchanged.
+class ParseCache():
+    version = 2
+
+    def __init__(self, path=None):
+        self.path = default_cache_dir() if path is None else path
+
+    def entry_path(self, filename, fdigest):
+        key = hashlib.sha256(
+            f'{self.version}\0{os.path.abspath(filename)}\0{fdigest}'.encode()
+        ).hexdigest()
+        return os.path.join(self.path, key[:2], key + '.pickle')
+
+    def get(self, filename, fdigest):
+        try:
+            with open(self.entry_path(filename, fdigest), 'rb') as f:
+                tree, deps = pickle.load(f)
+        # a corrupt or outdated entry may fail to unpickle in many ways
+        # (AttributeError, ImportError, ...), it is then parsed again
+        except Exception:
+            return None
+
+        for dep, ddigest in deps:
+            try:
+                if read_source(dep)[1] != ddigest:
+                    return None
+            except OSError:
+                return None
+        return tree, deps
+
+    def put(self, filename, fdigest, tree, deps):
+        path = self.entry_path(filename, fdigest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((tree, deps), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            pass
@@ -0,0 +1,77 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import save
+
+builtin_chains = ('PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING')
+
+
+def chain_signature(table, chain):
+    return [r.signature for r in table.rules.get(chain, ())]
+
+
+def table_delta(new, old):
+    declare, flush, append, delete = [], [], [], []
+    old_chains = dict(old.chains) if old else {}
+    old_rules = old.rules if old else {}
+    # rules may be added to builtin chains which aren't declared, without
+    # changing their policy
+    new_chains = dict(new.chains)
+    for chain in new.rules:
+        new_chains.setdefault(chain, None)
+
+    for chain in old_chains:
+        if chain in new_chains:
+            continue
+        if chain in builtin_chains:
+            if old_chains[chain] != 'ACCEPT':
+                declare.append(f':{chain} ACCEPT [0:0]')
+            if old_rules.get(chain):
+                flush.append(f'-F {chain}')
+        else:
+            flush.append(f'-F {chain}')
+            delete.append(f'-X {chain}')
+
+    for chain, policy in new_chains.items():
+        rules = new.rules.get(chain, ())
+        builtin = chain in builtin_chains
+        if chain not in old_chains:
+            if not builtin:
+                declare.append(f':{chain} - [0:0]')
+            elif policy is not None:
+                declare.append(f':{chain} {policy} [0:0]')
+        else:
+            if builtin and policy not in (None, old_chains[chain]):
+                declare.append(f':{chain} {policy} [0:0]')
+            if chain_signature(new, chain) == chain_signature(old, chain):
+                continue
+            if old_rules.get(chain):
+                flush.append(f'-F {chain}')
+        append.extend(r.line for r in rules)
+    return declare + flush + append + delete
+
+
+# restore script, to be loaded with iptables-restore --noflush, only
+# rewriting the chains which differ from the live ruleset
+def delta_lines(yip, live):
+    yield '# apply with iptables-restore --noflush'
+    for name, table in yip.tables.items():
+        new = save.parse(table.render_lines())[name]
+        lines = table_delta(new, live.get(name))
+        if lines:
+            yield f'*{name}'
+            yield from lines
+            yield 'COMMIT'
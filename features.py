@@ -14,8 +14,10 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import ipaddress
 from meta import meta, BaseMeta, YipSyntaxError
 from tools import (
+    yip_flatten_iter,
     yip_get_single_var,
     yip_format,
     yip_listize,
@@ -29,8 +31,23 @@ feature_map = {}
 _register_feature = Registrator(feature_map)
 
 
+# registers a feature class under the given names, for plugins adding their
+# own matches and targets
+def register_feature(*fnames):
+    def assign(cls):
+        if not (isinstance(cls, type) and issubclass(cls, BaseTarget)):
+            raise TypeError(f'{cls} is not a BaseTarget subclass')
+        return _register_feature(*fnames)(cls)
+    return assign
+
+
 class BaseTarget(BaseMeta):
     supports_negation = False
+    # each feature class gets a bit, and the mask of the bits of the classes
+    # it conflicts with, so that rules are checked with a few bit operations
+    bit = 0
+    conflict_mask = 0
+    _classes = 0
 
     def __meta__(self):
         return meta(self.rule)
@@ -38,6 +55,9 @@ class BaseTarget(BaseMeta):
     def __init__(self, rule, negated=False):
         self.rule = rule
         self.args = []
+        self.value = None
+        self.tokens = []
+        self.deps = []
         if negated:
             assert(self.supports_negation)
         self.negated = negated
@@ -49,11 +69,14 @@ class BaseTarget(BaseMeta):
     def add_dep(self, dep):
         assert(type(dep) is str)
         self.add_target(f'-m {dep}', k=5)
+        self.deps.append(dep)
         self.rule.dependencies.add(dep)
 
     def add_target(self, target, k=10):
         assert(type(target) is str)
-        self.rule.tokens.append((k, target))
+        token = (k, target)
+        self.tokens.append(token)
+        self.rule.tokens.append(token)
 
     @property
     def scope(self):
@@ -65,15 +88,22 @@ class BaseTarget(BaseMeta):
     def str_resolve(self, string):
         return yip_format(self.scope, yip_stringize(string))
 
-    def add_conflict(self, *items):
-        self.conflicts.add(set(items))
+    @classmethod
+    def add_conflict(cls, *items):
+        cls.conflicts.update(items)
+        cls.conflict_mask = 0
+        for confl_type in cls.conflicts:
+            cls.conflict_mask |= confl_type.bit
 
     def __init_subclass__(cls):
+        cls.bit = 1 << BaseTarget._classes
+        BaseTarget._classes += 1
         if 'conflicts' not in cls.__dict__:
             cls.conflicts = set()
 
         if hasattr(cls, 'self_conflict') and cls.self_conflict:
             cls.__dict__['conflicts'].add(cls)
+        cls.add_conflict()
 
     def check(self, typemap):
         if not hasattr(self, 'conflicts'):
@@ -98,7 +128,8 @@ class Negable(BaseTarget):
 @_register_feature('chain')
 class ChainTarget(ExclusiveTarget):
     def build(self, value):
-        self.rule.chain = self.str_resolve(value)
+        self.value = self.str_resolve(value)
+        self.rule.chain = self.value
 
 
 @_register_feature('target')
@@ -110,12 +141,14 @@ class Target(ExclusiveTarget):
 
         if target not in self.rule.table.chains:
             raise YipSyntaxError(rval, f'Undefined target: {target}')
+        self.value = target
+        self.comment = None
         self.add_target(f'-j {target}', k=1)
 
         if comment:
             self.add_dep('comment')
             comment.insert(0, target.capitalize())
-            com_body = ' '.join(comment)
+            com_body = self.comment = ' '.join(comment)
             self.add_target('--comment "%s"' % com_body.replace('"', '\\"'))
 
 
@@ -134,26 +167,30 @@ class Proto(ExclusiveTarget, Negable):
         if proto not in ('tcp', 'udp', 'icmp'):
             raise YipSyntaxError(self, f'Unknown protocol: `{proto}`')
 
+        self.value = proto
         self.add_target(' '.join(self.tneg + ['-p', proto]), k=2)
 
 
 @_register_feature('iface')
 class IFace(ExclusiveTarget, Negable):
     def build(self, value):
-        self.add_target(' '.join(self.tneg + ['-i', self.str_resolve(value)]))
+        self.value = self.str_resolve(value)
+        self.add_target(' '.join(self.tneg + ['-i', self.value]))
 
 
 @_register_feature('oface')
 class OFace(ExclusiveTarget, Negable):
     def build(self, value):
-        self.add_target(' '.join(self.tneg + ['-o', self.str_resolve(value)]))
+        self.value = self.str_resolve(value)
+        self.add_target(' '.join(self.tneg + ['-o', self.value]))
 
 
 @_register_feature('state')
 class State(ExclusiveTarget):
     def build(self, value):
         self.add_dep('state')
-        states = ','.join(self.resolve(yip_listize(value)))
+        self.value = self.resolve(yip_listize(value))
+        states = ','.join(self.value)
         self.add_target(f'--state {states}')
 
 
@@ -164,6 +201,7 @@ class PortTarget(ExclusiveTarget, Negable):
             yip_stringize,
             yip_listize(svar if svar else value)
         )))
+        self.value = plist
         need_multiset = len(plist) > 1 or self.negated
         if need_multiset:
             self.add_dep('multiport')
@@ -185,31 +223,62 @@ class SPort(PortTarget):
     multi_opt_name = 'sports'
 
 
-@_register_feature('saddr')
-class SAddr(ExclusiveTarget, Negable):
+# the smallest list of networks matching the same addresses, or the given
+# addresses when they aren't all networks of the same ip version
+def collapse_addresses(addrs):
+    try:
+        nets = [ipaddress.ip_network(a, strict=False) for a in addrs]
+        return [str(n) for n in ipaddress.collapse_addresses(nets)]
+    except (ValueError, TypeError):
+        return list(dict.fromkeys(addrs))
+
+
+# an address, or a list of addresses matched by a single rule
+class AddrTarget(ExclusiveTarget, Negable):
     def build(self, value):
-        self.add_target(' '.join(self.tneg + ['-s', self.str_resolve(value)]))
+        addrs = self.resolve(value)
+        if not isinstance(addrs, list):
+            self.value = yip_stringize(addrs)
+        else:
+            addrs = collapse_addresses(
+                [yip_stringize(a) for a in yip_flatten_iter(addrs)]
+            )
+            if not addrs:
+                raise YipSyntaxError(self, 'Empty address list')
+            if self.negated and len(addrs) > 1:
+                raise YipSyntaxError(
+                    self,
+                    "Can't negate a list of several addresses"
+                )
+            self.value = ','.join(addrs)
+        self.add_target(' '.join(self.tneg + [self.opt_name, self.value]))
+
+
+@_register_feature('saddr')
+class SAddr(AddrTarget):
+    opt_name = '-s'
 
 
 @_register_feature('daddr')
-class DAddr(ExclusiveTarget, Negable):
-    def build(self, value):
-        self.add_target(' '.join(self.tneg + ['-d', self.str_resolve(value)]))
+class DAddr(AddrTarget):
+    opt_name = '-d'
 
 
 @_register_feature('to-saddr')
 class ToSAddr(ExclusiveTarget):
     def build(self, value):
+        self.value = self.str_resolve(value)
         self.add_target(' '.join(
-            self.tneg + ['--to-source', self.str_resolve(value)]
+            self.tneg + ['--to-source', self.value]
         ))
 
 
 @_register_feature('to-daddr')
 class ToDAddr(ExclusiveTarget):
     def build(self, value):
+        self.value = self.str_resolve(value)
         self.add_target(' '.join(
-            self.tneg + ['--to-destination', self.str_resolve(value)]
+            self.tneg + ['--to-destination', self.value]
         ))
 
 
@@ -230,4 +299,22 @@ class IcmpType(ExclusiveTarget, Negable):
                 f"icmp-type requires a numeric parameter "
                 f"or 'all', got: `{ovalue}`"
             )
+        self.value = val
         self.add_target(' '.join(['--icmp-type'] + self.tneg + [val]))
+
+
+class MatchSet(ExclusiveTarget, Negable):
+    def build(self, value):
+        self.value = self.str_resolve(value)
+        self.add_dep('set')
+        self.add_target(' '.join(
+            self.tneg + ['--match-set', self.value, self.direction]
+        ))
+
+
+class SAddrSet(MatchSet):
+    direction = 'src'
+
+
+class DAddrSet(MatchSet):
+    direction = 'dst'
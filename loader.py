@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import io
 import yaml
 import os.path
 from ast_nodes import Not, Rule, IfDef
@@ -22,26 +24,29 @@ from yaml.composer import Composer
 from yaml.reader import Reader
 from yaml.scanner import Scanner
 from yaml.parser import Parser
+from cache import read_source
 from constructor import YipConstructor as YipCons
 from meta import BaseMeta, Meta
 
+try:
+    from yaml.cyaml import CParser
+except ImportError:
+    CParser = None
 
-# yaml.Loader,
-class YipLoader(BaseMeta, Reader, Scanner, Parser, Composer, YipCons, Resolver):
-    def __init__(self, stream):
-        self.meta = Meta(stream, 1, 1)
-        self._root = os.path.split(stream.name)[0]
-        Reader.__init__(self, stream)
-        Scanner.__init__(self)
-        Parser.__init__(self)
-        Composer.__init__(self)
-        YipCons.__init__(self)
-        Resolver.__init__(self)
+
+class YipHandlers(BaseMeta):
+    def init_handlers(self, name, imports):
+        self.meta = Meta(name, 1, 1)
+        self._root = os.path.split(name)[0]
+        self.imports = ImportTable() if imports is None else imports
+        # (path, digest) of the files imported while loading this stream
+        self.deps = []
 
     def import_handler(self, node):
         filename = os.path.join(self._root, self.construct_scalar(node))
-        with open(filename, 'r') as f:
-            return yaml.load(f, YipLoader)
+        tree, deps = self.imports.load(filename)
+        self.deps.extend(deps)
+        return tree
 
     def rule_handler(self, node):
         return Rule(self.construct_scalar(node))
@@ -52,11 +57,118 @@ class YipLoader(BaseMeta, Reader, Scanner, Parser, Composer, YipCons, Resolver):
     def not_handler(self, node):
         return Not(self.construct_scalar(node))
 
+    @classmethod
+    def register_handlers(cls):
+        cls.add_constructor('!import', cls.import_handler)
+        cls.add_constructor('!rule', cls.rule_handler)
+        cls.add_constructor('!not', cls.not_handler)
+        cls.add_constructor('!ifdef', cls.ifdef_handler)
+
+
+# yaml.Loader,
+class YipLoader(YipHandlers, Reader, Scanner, Parser, Composer, YipCons,
+                Resolver):
+    def __init__(self, stream, name=None, imports=None):
+        if name is None:
+            name = stream.name
+        self.init_handlers(name, imports)
+        Reader.__init__(self, stream)
+        self.name = name
+        Scanner.__init__(self)
+        Parser.__init__(self)
+        Composer.__init__(self)
+        YipCons.__init__(self)
+        Resolver.__init__(self)
+
     def load(fd):
         return yaml.load(fd, YipLoader)
 
+    def load_file(filename, cache=None):
+        return ImportTable(cache).load(filename)[0]
+
+
+YipLoader.register_handlers()
+
+if CParser is not None:
+    # libyaml based loader, producing the same marks as YipLoader
+    class YipCLoader(YipHandlers, CParser, YipCons, Resolver):
+        def __init__(self, stream, name=None, imports=None):
+            if name is None:
+                name = stream.name
+            self.init_handlers(name, imports)
+            if isinstance(stream, str):
+                stream = io.StringIO(stream)
+                stream.name = name
+            CParser.__init__(self, stream)
+            YipCons.__init__(self)
+            Resolver.__init__(self)
+
+    YipCLoader.register_handlers()
+    default_loader = YipCLoader
+else:
+    default_loader = YipLoader
+
+
+# files loaded during a compilation, each parsed once. The returned trees are
+# shared between import sites and must not be modified.
+class ImportTable():
+    def __init__(self, cache=None, loader=None, timings=None):
+        self.cache = cache
+        self.loader = default_loader if loader is None else loader
+        self.timings = timings
+        self.trees = {}
+        # last loaded entry of each file
+        self.files = {}
+
+    def load(self, filename):
+        key = (os.path.abspath(filename), os.stat(filename).st_mtime_ns)
+        entry = self.trees.get(key)
+        if entry is None:
+            if self.timings is None:
+                measure = contextlib.nullcontext()
+            else:
+                measure = self.timings.measure('import', filename)
+            with measure:
+                entry = self.trees[key] = self.parse(filename)
+        self.files[key[0]] = entry
+        return entry
+
+    # parse a changed file again, and replace the content of its previous
+    # tree, so that the trees importing it see the changes. Returns None when
+    # the previous tree can't be updated in place.
+    def reload(self, filename):
+        path = os.path.abspath(filename)
+        old = self.files.get(path)
+        tree, deps = self.load(filename)
+        if old is None or type(old[0]) is not type(tree):
+            return None
+        otree = old[0]
+        if isinstance(otree, dict):
+            otree.clear()
+            otree.update(tree)
+        elif isinstance(otree, list):
+            otree[:] = tree
+        else:
+            return None
+        otree.meta = tree.meta
+        key = (path, os.stat(filename).st_mtime_ns)
+        entry = self.trees[key] = self.files[path] = (otree, deps)
+        return entry
+
+    def parse(self, filename):
+        content, fdigest = read_source(filename)
+        deps = [(os.path.abspath(filename), fdigest)]
+        cached = self.cache and self.cache.get(filename, fdigest)
+        if cached:
+            tree, fdeps = cached
+            return tree, list(dict.fromkeys(deps + fdeps))
 
-YipLoader.add_constructor('!import', YipLoader.import_handler)
-YipLoader.add_constructor('!rule', YipLoader.rule_handler)
-YipLoader.add_constructor('!not', YipLoader.not_handler)
-YipLoader.add_constructor('!ifdef', YipLoader.ifdef_handler)
+        loader = self.loader(content, filename, self)
+        try:
+            tree = loader.get_single_data()
+        finally:
+            loader.dispose()
+        fdeps = list(dict.fromkeys(loader.deps))
+        if self.cache:
+            self.cache.put(filename, fdigest, tree, fdeps)
+        return tree, list(dict.fromkeys(deps + fdeps))
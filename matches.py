@@ -0,0 +1,265 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+import re
+import features
+from tools import Registrator
+
+_protocols = {'icmp': 1, 'tcp': 6, 'udp': 17}
+_states = ('INVALID', 'NEW', 'ESTABLISHED', 'RELATED', 'UNTRACKED')
+_octet = r'(0|[1-9][0-9]{0,2})'
+_ipv4 = re.compile(rf'^{_octet}\.{_octet}\.{_octet}\.{_octet}(?:/{_octet})?$')
+
+# targets which don't restrict the set of matched packets
+action_types = (
+    features.ChainTarget,
+    features.Target,
+    features.ToSAddr,
+    features.ToDAddr,
+)
+
+field_map = {}
+
+_register_field = Registrator(field_map)
+
+
+class IntervalSet():
+    def __init__(self, intervals, universe):
+        self.universe = universe
+        self.intervals = []
+        for lo, hi in sorted(intervals):
+            if self.intervals and lo <= self.intervals[-1][1] + 1:
+                last = self.intervals[-1]
+                self.intervals[-1] = (last[0], max(last[1], hi))
+            else:
+                self.intervals.append((lo, hi))
+
+    def complement(self):
+        res = []
+        cur, end = self.universe
+        for lo, hi in self.intervals:
+            if lo > cur:
+                res.append((cur, lo - 1))
+            cur = hi + 1
+        if cur <= end:
+            res.append((cur, end))
+        return IntervalSet(res, self.universe)
+
+    def isdisjoint(self, other):
+        i = j = 0
+        a, b = self.intervals, other.intervals
+        while i < len(a) and j < len(b):
+            if a[i][1] < b[j][0]:
+                i += 1
+            elif b[j][1] < a[i][0]:
+                j += 1
+            else:
+                return False
+        return True
+
+    def issubset(self, other):
+        return self.isdisjoint(other.complement())
+
+    def isfull(self):
+        return not self.complement().intervals
+
+
+class IfaceSet():
+    def __init__(self, name, negated=False):
+        self.wildcard = name.endswith('+')
+        self.name = name[:-1] if self.wildcard else name
+        self.negated = negated
+
+    @staticmethod
+    def _pat_subset(p, q):
+        if q.wildcard:
+            return p.name.startswith(q.name)
+        return not p.wildcard and p.name == q.name
+
+    @staticmethod
+    def _pat_disjoint(p, q):
+        if not p.wildcard and not q.wildcard:
+            return p.name != q.name
+        return not (p.name.startswith(q.name) and q.wildcard
+                    or q.name.startswith(p.name) and p.wildcard)
+
+    def isdisjoint(self, other):
+        if self.negated and other.negated:
+            return False
+        if self.negated:
+            return self._pat_subset(other, self)
+        if other.negated:
+            return self._pat_subset(self, other)
+        return self._pat_disjoint(self, other)
+
+    def isfull(self):
+        return not self.negated and self.wildcard and not self.name
+
+    def issubset(self, other):
+        if self.negated and other.negated:
+            return self._pat_subset(other, self)
+        if self.negated:
+            return False
+        if other.negated:
+            return self._pat_disjoint(self, other)
+        return self._pat_subset(self, other)
+
+
+def _signed(intervals, universe, negated):
+    res = IntervalSet(intervals, universe)
+    return res.complement() if negated else res
+
+
+# (network, prefix length) of an ipv4 network, without going through
+# ipaddress for the usual a.b.c.d[/n] notation
+def ipv4_prefix(addr):
+    match = _ipv4.match(addr)
+    if match:
+        a, b, c, d = map(int, match.group(1, 2, 3, 4))
+        plen = int(match.group(5) or 32)
+        if max(a, b, c, d) < 256 and plen <= 32:
+            value = a << 24 | b << 16 | c << 8 | d
+            return value & (0xffffffff << (32 - plen)) & 0xffffffff, plen
+    try:
+        net = ipaddress.ip_network(addr, strict=False)
+    except ValueError:
+        return None
+    if net.version != 4:
+        return None
+    return int(net.network_address), net.prefixlen
+
+
+def _networks(value):
+    res = []
+    for addr in value.split(','):
+        prefix = ipv4_prefix(addr)
+        if prefix is None:
+            return None
+        net, plen = prefix
+        res.append((net, net | (1 << (32 - plen)) - 1))
+    return res
+
+
+def _ports(value):
+    res = []
+    for port in (p for e in value for p in e.split(',') if p):
+        first, _, last = port.partition(':')
+        try:
+            res.append((int(first or 0), int(last or first or 65535)))
+        except ValueError:
+            return None
+    return res
+
+
+@_register_field(features.Proto)
+def proto_field(target):
+    if target.value is None:
+        return IntervalSet([(0, 255)], (0, 255))
+    proto = _protocols[target.value]
+    return _signed([(proto, proto)], (0, 255), target.negated)
+
+
+@_register_field(features.SAddr, features.DAddr)
+def addr_field(target):
+    nets = _networks(target.value)
+    if nets is None:
+        return None
+    return _signed(nets, (0, 2 ** 32 - 1), target.negated)
+
+
+@_register_field(features.DPort, features.SPort)
+def port_field(target):
+    ports = _ports(target.value)
+    if ports is None:
+        return None
+    return _signed(ports, (0, 65535), target.negated)
+
+
+@_register_field(features.State)
+def state_field(target):
+    try:
+        states = [_states.index(s.upper()) for s in target.value]
+    except ValueError:
+        return None
+    return IntervalSet([(s, s) for s in states], (0, len(_states) - 1))
+
+
+@_register_field(features.IcmpType)
+def icmp_field(target):
+    icmp = int(target.value)
+    if icmp == 255:
+        # ! --icmp-type all doesn't match any packet
+        return _signed([(0, 255)], (0, 255), target.negated)
+    return _signed([(icmp, icmp)], (0, 255), target.negated)
+
+
+@_register_field(features.IFace, features.OFace)
+def iface_field(target):
+    return IfaceSet(target.value, target.negated)
+
+
+# over-approximation of the packets matched by a rule: a packet matched by
+# the rule is always in its space, the converse only holds for exact spaces
+class MatchSpace():
+    def __init__(self, rule):
+        self.rule = rule
+        self.fields = {}
+        self.exact = True
+        for target in rule.targets:
+            ttype = type(target)
+            if ttype in action_types:
+                continue
+            build = field_map.get(ttype)
+            field = build(target) if build else None
+            if field is not None:
+                self.fields[ttype] = field
+            else:
+                self.exact = False
+
+    def isdisjoint(self, other):
+        return any(
+            field.isdisjoint(other.fields[ftype])
+            for ftype, field in self.fields.items()
+            if ftype in other.fields
+        )
+
+    def issuperset(self, other):
+        if not self.exact:
+            return False
+        for ftype, field in self.fields.items():
+            ofield = other.fields.get(ftype)
+            if ofield is None:
+                if not field.isfull():
+                    return False
+            elif not ofield.issubset(field):
+                return False
+        return True
+
+
+def action(rule):
+    return (rule.verdict,) + tuple(
+        t.value for t in rule.targets
+        if type(t) in (features.ToSAddr, features.ToDAddr)
+    )
+
+
+def commute(a, b, aspace=None, bspace=None):
+    if a.terminal and b.terminal and action(a) == action(b):
+        return True
+    aspace = MatchSpace(a) if aspace is None else aspace
+    bspace = MatchSpace(b) if bspace is None else bspace
+    return aspace.isdisjoint(bspace)
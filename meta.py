@@ -1,17 +1,33 @@
+import sys
+
+
+# one of these is kept for every parsed node: file names are shared, and
+# the position is packed into a single int
 class Meta():
+    __slots__ = ('file', 'pos')
+
     def __meta__(self):
         return self
 
     def __init__(self, f, l, c):
-        self.line = l
-        self.file = str(f)
-        self.col = c
+        self.file = sys.intern(str(f))
+        self.pos = l << 32 | c
+
+    @property
+    def line(self):
+        return self.pos >> 32
+
+    @property
+    def col(self):
+        return self.pos & 0xffffffff
 
     def __str__(self):
         return f'{self.file}:{self.line}'
 
 
 class BaseMeta():
+    __slots__ = ()
+
     def __meta__(self):
         assert(self.meta is not None)
         return self.meta
@@ -31,6 +47,9 @@ class YipSyntaxError(BaseMeta, Exception):
         self.parent = parent
         self.meta = meta(ometa)
 
+    def __reduce__(self):
+        return (type(self), (self.meta, self.args[0], self.parent))
+
     def __str__(self):
         msg = super().__str__()
         return f'{msg}:\n\t{str(self.meta)}'
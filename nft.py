@@ -0,0 +1,377 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import features
+from matches import ipv4_prefix
+from meta import YipSyntaxError
+from passes import chain_rules, consecutive, disjoint_ranges, port_range
+from tools import Registrator
+
+# nft chain type and priority of the builtin chains of each table
+_base_chains = {
+    'filter': ('filter', 0, ('INPUT', 'FORWARD', 'OUTPUT')),
+    'nat': ('nat', None, ('PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING')),
+    'mangle': ('filter', -150, ('PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT',
+                                'POSTROUTING')),
+    'raw': ('filter', -300, ('PREROUTING', 'OUTPUT')),
+    'security': ('filter', 50, ('INPUT', 'FORWARD', 'OUTPUT')),
+}
+
+_nat_priorities = {
+    'PREROUTING': -100,
+    'INPUT': 100,
+    'OUTPUT': -100,
+    'POSTROUTING': 100,
+}
+
+_verdicts = {
+    'ACCEPT': 'accept',
+    'DROP': 'drop',
+    'RETURN': 'return',
+    'REJECT': 'reject',
+    'MASQUERADE': 'masquerade',
+}
+
+# verdicts which can be used in verdict maps
+_map_verdicts = ('accept', 'drop', 'return')
+
+_max_comment = 128
+
+match_map = {}
+
+_register_match = Registrator(match_map)
+
+
+def base_chain(table, chain):
+    ctype, priority, chains = _base_chains.get(table, (None, None, ()))
+    if chain not in chains:
+        return None
+    if ctype == 'nat':
+        priority = _nat_priorities[chain]
+    elif table == 'mangle' and chain == 'OUTPUT':
+        ctype = 'route'
+    return ctype, chain.lower(), priority
+
+
+def render_values(values):
+    if len(values) == 1:
+        return values[0]
+    return '{ ' + ', '.join(values) + ' }'
+
+
+def quote(s):
+    return '"' + s.replace('"', "'") + '"'
+
+
+def ports(value):
+    res = []
+    for port in (p for e in value for p in e.split(',') if p):
+        first, _, last = port.partition(':')
+        if not last:
+            res.append(first)
+        else:
+            res.append(f'{first or 0}-{last}')
+    return res
+
+
+def implied_proto(rule):
+    proto = rule.target(features.Proto)
+    if proto is None or proto.value is None or proto.negated:
+        return None
+    icmp = rule.target(features.IcmpType)
+    if proto.value == 'icmp' and icmp is not None and icmp.value != '255':
+        return 'icmp'
+    if proto.value in ('tcp', 'udp') and (rule.target(features.DPort)
+                                         or rule.target(features.SPort)):
+        return proto.value
+    return None
+
+
+@_register_match(features.Proto)
+def proto_match(rule, target):
+    if target.value is None or implied_proto(rule):
+        return None
+    return 'ip protocol', target.negated, (target.value,)
+
+
+@_register_match(features.SAddr, features.DAddr)
+def addr_match(rule, target):
+    selector = 'ip saddr' if type(target) is features.SAddr else 'ip daddr'
+    return selector, target.negated, tuple(target.value.split(','))
+
+
+@_register_match(features.SAddrSet, features.DAddrSet)
+def addr_set_match(rule, target):
+    selector = 'ip saddr' if target.direction == 'src' else 'ip daddr'
+    return selector, target.negated, (f'@{target.value}',)
+
+
+@_register_match(features.DPort, features.SPort)
+def port_match(rule, target):
+    proto = implied_proto(rule) or 'th'
+    option = 'dport' if type(target) is features.DPort else 'sport'
+    return f'{proto} {option}', target.negated, tuple(ports(target.value))
+
+
+@_register_match(features.IFace, features.OFace)
+def iface_match(rule, target):
+    selector = 'iifname' if type(target) is features.IFace else 'oifname'
+    name = target.value
+    if name.endswith('+'):
+        name = name[:-1] + '*'
+    return selector, target.negated, (quote(name),)
+
+
+@_register_match(features.State)
+def state_match(rule, target):
+    return 'ct state', False, tuple(s.lower() for s in target.value)
+
+
+# rules iptables never matches, which nft can't express
+def never_matches(rule):
+    icmp = rule.target(features.IcmpType)
+    return icmp is not None and icmp.negated and icmp.value == '255'
+
+
+@_register_match(features.IcmpType)
+def icmp_match(rule, target):
+    if target.value == '255':
+        # never negated, the rules of ! --icmp-type all are left out
+        return None
+    return 'icmp type', target.negated, (target.value,)
+
+
+def _addr_ranges(values):
+    res = []
+    for value in values:
+        prefix = ipv4_prefix(value)
+        if prefix is None:
+            return None
+        net, plen = prefix
+        res.append((net, net | (1 << (32 - plen)) - 1))
+    return res
+
+
+def _port_ranges(values):
+    res = []
+    for value in values:
+        res.append(port_range(value.replace('-', ':')))
+    return None if None in res else res
+
+
+# whether a packet can't match several of the values, which nft also
+# requires for the elements of interval sets
+def disjoint(selector, values):
+    if selector.endswith('addr'):
+        ranges = _addr_ranges(values)
+    elif selector.endswith('port'):
+        ranges = _port_ranges(values)
+    else:
+        if any('*' in v or v.startswith('@') for v in values):
+            return False
+        return len(set(values)) == len(values)
+    return ranges is not None and disjoint_ranges(ranges)
+
+
+class NftRule():
+    def __init__(self, rule):
+        self.rule = rule
+        # (selector, negated, values)
+        self.matches = []
+        self.statements = []
+        self.verdict = None
+        # (selector, [(value, verdict)])
+        self.vmap = None
+        # index of the match whose values were merged from several rules
+        self.merged = None
+        # whether a nat statement maps ports, which needs a single transport
+        # protocol
+        self.nat_ports = False
+        target = rule.target(features.Target)
+        self.comment = target.comment if target else None
+
+        for target in rule.targets:
+            build = match_map.get(type(target))
+            if build is not None:
+                match = build(rule, target)
+                if match is not None:
+                    self.matches.append(match)
+
+        verdict = rule.verdict
+        if verdict in ('SNAT', 'DNAT'):
+            snat = verdict == 'SNAT'
+            addr = rule.target(features.ToSAddr if snat else features.ToDAddr)
+            if addr is None:
+                fname = 'to-saddr' if snat else 'to-daddr'
+                raise YipSyntaxError(rule, f'{verdict} requires {fname}')
+            self.statements.append(f'{verdict.lower()} to {addr.value}')
+            self.nat_ports = ':' in addr.value
+        elif verdict in _verdicts:
+            self.verdict = _verdicts[verdict]
+        elif verdict is not None:
+            self.verdict = f'jump {verdict}'
+
+    def merge(self, other):
+        if (self.vmap or other.vmap or self.verdict != other.verdict
+                or self.statements != other.statements
+                or len(self.matches) != len(other.matches)):
+            return False
+        diff = [
+            i for i, (a, b) in enumerate(zip(self.matches, other.matches))
+            if a != b
+        ]
+        if len(diff) != 1 or self.merged not in (None, diff[0]):
+            return False
+        i = diff[0]
+        selector, negated, values = self.matches[i]
+        oselector, onegated, ovalues = other.matches[i]
+        values = values + ovalues
+        if selector == 'ip protocol' and self.nat_ports:
+            return False
+        if (selector != oselector or negated or onegated
+                or not disjoint(selector, values)):
+            return False
+        self.matches[i] = (selector, False, values)
+        self.merged = i
+        if self.comment != other.comment:
+            self.comment = None
+        return True
+
+    def render(self):
+        res = []
+        for selector, negated, values in self.matches:
+            neg = '!= ' if negated else ''
+            res.append(f'{selector} {neg}{render_values(values)}')
+        res.extend(self.statements)
+        if self.vmap is not None:
+            selector, entries = self.vmap
+            res.append(f'{selector} vmap ' + render_values(
+                [f'{value} : {verdict}' for value, verdict in entries]
+            ))
+        elif self.verdict is not None:
+            res.append(self.verdict)
+        if not res:
+            res.append('counter')
+        if self.comment:
+            res.append(f'comment {quote(self.comment[:_max_comment])}')
+        return ' '.join(res)
+
+
+# rules only differing by the interface they match and their verdict are
+# replaced by a verdict map on the interface
+def vmap_key(selector):
+    def key(rule):
+        if rule.statements or rule.vmap or rule.verdict is None:
+            return None
+        verdict = rule.verdict
+        if verdict not in _map_verdicts and not verdict.startswith('jump '):
+            return None
+        found = [m for m in rule.matches if m[0] == selector]
+        if len(found) != 1:
+            return None
+        _, negated, values = found[0]
+        if negated or len(values) != 1 or '*' in values[0]:
+            return None
+        return tuple(m for m in rule.matches if m[0] != selector)
+    return key
+
+
+def merge_vmaps(rules, selector):
+    for group in consecutive(rules, vmap_key(selector)):
+        names = [
+            m[2][0] for r in group for m in r.matches if m[0] == selector
+        ]
+        verdicts = {r.verdict for r in group}
+        if (len(group) < 2 or len(verdicts) < 2
+                or len(set(names)) != len(names)):
+            yield from group
+            continue
+        nrule = group[0]
+        nrule.vmap = (selector, list(zip(names, (r.verdict for r in group))))
+        nrule.matches = [m for m in nrule.matches if m[0] != selector]
+        nrule.verdict = None
+        if any(r.comment != nrule.comment for r in group):
+            nrule.comment = None
+        yield nrule
+
+
+def merge_sets(rules):
+    res = []
+    for rule in rules:
+        if not res or not res[-1].merge(rule):
+            res.append(rule)
+    return res
+
+
+def chain_lines(table, chain, policy, rules):
+    yield f'\tchain {chain} {{'
+    base = base_chain(table.name, chain)
+    if base is not None:
+        ctype, hook, priority = base
+        policy = (policy or 'ACCEPT').lower()
+        yield (f'\t\ttype {ctype} hook {hook} priority {priority}; '
+               f'policy {policy};')
+    for rule in rules:
+        yield f'\t\t{rule.render()}'
+    yield '\t}'
+
+
+def set_lines(name, entries):
+    yield f'\tset {name} {{'
+    yield '\t\ttype ipv4_addr'
+    yield '\t\tflags interval'
+    yield '\t\tauto-merge'
+    yield f'\t\telements = {{ {", ".join(dict.fromkeys(entries))} }}'
+    yield '\t}'
+
+
+# the table is created if missing, then deleted and defined again, which
+# nft -f applies as a single transaction
+def table_lines(table):
+    if table.lazy_rules is not None or any(
+        r.targets is None for r in table.rules
+    ):
+        raise ValueError("the nft backend can't render compact or lazy rules")
+
+    chains = dict(table.local_chains)
+    rules = chain_rules(table.rules)
+    for chain in rules:
+        chains.setdefault(chain, None)
+
+    yield f'table ip {table.name}'
+    yield f'delete table ip {table.name}'
+    yield f'table ip {table.name} {{'
+    for name, entries in table.ipsets.items():
+        yield from set_lines(name, entries)
+        yield ''
+    for i, (chain, policy) in enumerate(chains.items()):
+        if i:
+            yield ''
+        nrules = [
+            NftRule(r) for r in rules.get(chain, ()) if not never_matches(r)
+        ]
+        for selector in ('iifname', 'oifname'):
+            nrules = list(merge_vmaps(nrules, selector))
+        nrules = merge_sets(nrules)
+        if policy == '-':
+            policy = None
+        yield from chain_lines(table, chain, policy, nrules)
+    yield '}'
+
+
+def header_lines():
+    yield '#!/usr/sbin/nft -f'
+    yield ''
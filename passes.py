@@ -0,0 +1,553 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+import logging
+from bisect import bisect
+from collections import deque
+from features import (
+    SAddr,
+    DAddr,
+    SAddrSet,
+    DAddrSet,
+    DPort,
+    SPort,
+    State,
+    ChainTarget,
+    Target,
+)
+from matches import MatchSpace, commute, ipv4_prefix
+from meta import meta
+from rule import Rule
+from save import rule_signature
+from tools import Registrator
+
+# optimization passes run on built tables, in registration order
+pass_map = {}
+
+_conntrack_states = {'ESTABLISHED', 'RELATED'}
+
+_register_pass = Registrator(pass_map)
+
+
+def chain_rules(rules):
+    chains = {}
+    for rule in rules:
+        chains.setdefault(rule.chain, []).append(rule)
+    return chains
+
+
+def consecutive(rules, key):
+    group, gkey = [], None
+    for rule in rules:
+        rkey = key(rule)
+        if group and (rkey is None or rkey != gkey):
+            yield group
+            group = []
+        group.append(rule)
+        gkey = rkey
+        if rkey is None:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def ipv4_network(addr):
+    try:
+        net = ipaddress.ip_network(addr, strict=False)
+    except ValueError:
+        return None
+    return net if net.version == 4 else None
+
+
+def disjoint_networks(nets):
+    nets = sorted(nets)
+    return all(a.broadcast_address < b.network_address
+               for a, b in zip(nets, nets[1:]))
+
+
+def port_range(port):
+    first, _, last = port.partition(':')
+    try:
+        return int(first or 0), int(last or first or 65535)
+    except ValueError:
+        return None
+
+
+def source_prefix(rule):
+    target = rule.target(SAddr)
+    if target is None:
+        return 0, 0
+    if target.negated:
+        return None
+    return ipv4_prefix(target.value)
+
+
+# groups the rules which only differ by the network they match, such as the
+# ones of a with_items loop over addresses
+def address_key(addr_type):
+    def key(rule):
+        target = rule.target(addr_type)
+        if target is None or target.negated:
+            return None
+        net = ipv4_network(target.value)
+        if net is None or net.prefixlen == 0:
+            return None
+        return rule.signature(addr_type)
+    return key
+
+
+def disjoint_ranges(ranges):
+    ranges = sorted(ranges)
+    return all(a[1] < b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+class BasePass():
+    def __init__(self, table):
+        self.table = table
+
+    def run(self):
+        chains = chain_rules(self.table.rules)
+        self.table.rules = [
+            rule
+            for chain, rules in chains.items()
+            for rule in self.run_chain(chain, rules)
+        ]
+
+
+# drops the copies of an earlier terminal rule of their chain, which never
+# match. Rules are indexed by their tokens, regardless of the order their
+# features were given in.
+@_register_pass('dedup')
+class DedupPass(BasePass):
+    @staticmethod
+    def key(rule):
+        signature = rule.signature()
+        return signature[:2] + tuple(sorted(signature[2:]))
+
+    def run_chain(self, chain, rules):
+        index = {}
+        res = []
+        for rule in rules:
+            if rule.terminal:
+                first = index.setdefault(self.key(rule), rule)
+                if first is not rule:
+                    logging.warning(
+                        f'{meta(rule)}: duplicate of the rule at '
+                        f'{meta(first)}, dropped'
+                    )
+                    continue
+            res.append(rule)
+        return res
+
+
+# rules indexed by source network: the rules which may cover a given rule are
+# the ones whose network contains its own, found by looking up each of its
+# prefixes
+class PrefixIndex():
+    def __init__(self):
+        # (network, prefix length) -> [(rule, space)]
+        self.prefixes = {}
+        self.lengths = []
+        # rules without a single source network
+        self.others = []
+
+    def add(self, prefix, rule, space):
+        if prefix is None:
+            self.others.append((rule, space))
+            return
+        if prefix[1] not in self.lengths:
+            self.lengths.append(prefix[1])
+            self.lengths.sort()
+        self.prefixes.setdefault(prefix, []).append((rule, space))
+
+    def candidates(self, prefix):
+        yield from self.others
+        if prefix is None:
+            for entries in self.prefixes.values():
+                yield from entries
+            return
+        net, length = prefix
+        for plen in self.lengths:
+            if plen > length:
+                break
+            mask = (0xffffffff << (32 - plen)) & 0xffffffff
+            yield from self.prefixes.get((net & mask, plen), ())
+
+
+# drops the rules which can't match, as an earlier terminal rule matches
+# every packet they would
+@_register_pass('shadow')
+class ShadowPass(BasePass):
+    def run_chain(self, chain, rules):
+        keep = self.table.yip.keep_shadowed
+        index = PrefixIndex()
+        res = []
+        for rule in rules:
+            space = MatchSpace(rule)
+            prefix = source_prefix(rule)
+            shadow = next((
+                other for other, ospace in index.candidates(prefix)
+                if ospace.issuperset(space)
+            ), None)
+            if shadow is not None:
+                logging.warning(
+                    f'{meta(rule)}: rule never matches, shadowed by '
+                    f'the rule at {meta(shadow)}'
+                )
+                if keep:
+                    res.append(rule)
+                continue
+            res.append(rule)
+            if rule.terminal and space.exact:
+                index.add(prefix, rule, space)
+        return res
+
+
+# replaces consecutive rules which only differ by their address by one rule
+# for each network of the smallest list covering the same addresses
+@_register_pass('aggregate')
+class AggregatePass(BasePass):
+    addr_types = (SAddr, DAddr)
+
+    def aggregate(self, rules, addr_type):
+        for group in consecutive(rules, address_key(addr_type)):
+            if len(group) < 2:
+                yield from group
+                continue
+
+            nets = [ipv4_network(r.target(addr_type).value) for r in group]
+            collapsed = list(ipaddress.collapse_addresses(nets))
+            if len(collapsed) == len(group) or (
+                not group[0].terminal and not disjoint_networks(nets)
+            ):
+                yield from group
+                continue
+
+            for net in collapsed:
+                nrule = group[0].copy()
+                nrule.remove_target(nrule.target(addr_type))
+                nrule.add_feature(addr_type, str(net))
+                yield nrule
+
+    def run_chain(self, chain, rules):
+        for addr_type in self.addr_types:
+            rules = list(self.aggregate(rules, addr_type))
+        return rules
+
+
+@_register_pass('ipset')
+class IpsetPass(BasePass):
+    min_items = 2
+    # sets are always created with the same options, so that create -exist
+    # accepts the live ones whatever the size of their previous contents
+    max_items = 1 << 24
+    set_options = f'hash:net family inet maxelem {max_items}'
+    set_types = {
+        SAddr: SAddrSet,
+        DAddr: DAddrSet,
+    }
+
+    def set_key(self, addr_type):
+        return address_key(addr_type)
+
+    def add_set(self, entries):
+        name = f'yip-{self.table.name}-{len(self.table.ipsets)}'
+        self.table.ipsets[name] = entries
+        return name
+
+    def collapse(self, rules, addr_type):
+        for group in consecutive(rules, self.set_key(addr_type)):
+            if not self.min_items <= len(group) <= self.max_items:
+                yield from group
+                continue
+
+            nets = [ipv4_network(r.target(addr_type).value) for r in group]
+            if not group[0].terminal and not disjoint_networks(nets):
+                # a packet matching several addresses would hit a
+                # non-terminal target several times
+                yield from group
+                continue
+
+            name = self.add_set([str(n) for n in nets])
+            nrule = group[0].copy()
+            nrule.remove_target(nrule.target(addr_type))
+            nrule.add_feature(self.set_types[addr_type], name)
+            yield nrule
+
+    def run_chain(self, chain, rules):
+        for addr_type in self.set_types:
+            rules = list(self.collapse(rules, addr_type))
+        return rules
+
+    # each set is loaded into a temporary set, which is then swapped with the
+    # live one, so that the live set is never seen partially loaded
+    @classmethod
+    def render_sets(cls, ipsets):
+        for name, entries in ipsets.items():
+            tmp = f'{name}-new'
+            yield f'create {name} {cls.set_options} -exist'
+            yield f'create {tmp} {cls.set_options} -exist'
+            yield f'flush {tmp}'
+            for entry in entries:
+                yield f'add {tmp} {entry}'
+            yield f'swap {tmp} {name}'
+            yield f'destroy {tmp}'
+
+
+@_register_pass('multiport')
+class MultiportPass(BasePass):
+    # the kernel multiport match holds up to 15 ports, ranges using two
+    max_slots = 15
+    port_types = (DPort, SPort)
+
+    @staticmethod
+    def ports(target):
+        return [p for e in target.value for p in e.split(',') if p]
+
+    def port_key(self, port_type):
+        def key(rule):
+            target = rule.target(port_type)
+            if target is None or target.negated:
+                return None
+            if any(port_range(p) is None for p in self.ports(target)):
+                return None
+            return rule.signature(port_type)
+        return key
+
+    def chunks(self, ports):
+        chunk, slots = [], 0
+        for port in ports:
+            size = 2 if ':' in port else 1
+            if chunk and slots + size > self.max_slots:
+                yield chunk
+                chunk, slots = [], 0
+            chunk.append(port)
+            slots += size
+        if chunk:
+            yield chunk
+
+    def merge(self, rules, port_type):
+        for group in consecutive(rules, self.port_key(port_type)):
+            if len(group) < 2:
+                yield from group
+                continue
+
+            ports = list(dict.fromkeys(
+                p for r in group for p in self.ports(r.target(port_type))
+            ))
+            chunks = list(self.chunks(ports))
+            if len(chunks) >= len(group):
+                yield from group
+                continue
+
+            ranges = [port_range(p) for p in ports]
+            if not group[0].terminal and not disjoint_ranges(ranges):
+                yield from group
+                continue
+
+            for chunk in chunks:
+                nrule = group[0].copy()
+                nrule.remove_target(nrule.target(port_type))
+                nrule.add_feature(port_type, chunk)
+                yield nrule
+
+    def run_chain(self, chain, rules):
+        for port_type in self.port_types:
+            rules = list(self.merge(rules, port_type))
+        return rules
+
+
+# moves the rules accepting established connections to the head of their
+# chain, when the rules they move above provably can't give the packets they
+# match another outcome. The others are reported, along with the rule
+# keeping them in place.
+@_register_pass('hoist')
+class HoistPass(BasePass):
+    @staticmethod
+    def conntrack(rule):
+        state = rule.target(State)
+        if state is None or rule.verdict != 'ACCEPT':
+            return False
+        return {s.upper() for s in state.value} <= _conntrack_states
+
+    def run_chain(self, chain, rules):
+        head, rest, spaces = [], [], []
+        for rule in rules:
+            if not self.conntrack(rule):
+                rest.append(rule)
+                continue
+            space = MatchSpace(rule)
+            spaces.extend(MatchSpace(r) for r in rest[len(spaces):])
+            blocker = next((
+                other for other, ospace in zip(rest, spaces)
+                if not commute(other, rule, ospace, space)
+            ), None)
+            if blocker is not None:
+                logging.warning(
+                    f'{meta(rule)}: established connections rule not '
+                    f'hoisted, the rule at {meta(blocker)} may match the '
+                    f'same packets'
+                )
+                rest.append(rule)
+                continue
+            head.append(rule)
+        return head + rest
+
+
+@_register_pass('reorder')
+class ReorderPass(BasePass):
+    def hits(self, chain, rules):
+        saved = self.table.yip.counters.get(self.table.name)
+        counts = {}
+        for srule in saved.rules.get(chain, ()) if saved else ():
+            counts.setdefault(srule.signature, deque()).append(srule.packets)
+
+        res = []
+        for rule in rules:
+            queue = counts.get(rule_signature(rule))
+            res.append(queue.popleft() if queue else 0)
+        return res
+
+    def run_chain(self, chain, rules):
+        hits = self.hits(chain, rules)
+        spaces = [MatchSpace(r) for r in rules]
+        order = []
+        # insertion sort, only swapping rules which can't match the same
+        # packet with different outcomes
+        for i, rule in enumerate(rules):
+            pos = len(order)
+            while pos:
+                j = order[pos - 1]
+                if hits[j] >= hits[i]:
+                    break
+                if not commute(rules[j], rule, spaces[j], spaces[i]):
+                    break
+                pos -= 1
+            order.insert(pos, i)
+        return [rules[i] for i in order]
+
+
+@_register_pass('split')
+class SplitPass(BasePass):
+    min_rules = 16
+    leaf_rules = 4
+    addr_types = (SAddr, DAddr)
+
+    def __init__(self, table):
+        super().__init__(table)
+        self.chain_count = 0
+
+    def split_net(self, rule, addr_type):
+        target = rule.target(addr_type)
+        if target is None or target.negated or rule.verdict == 'RETURN':
+            return None
+        return ipv4_network(target.value)
+
+    def runs(self, chain, rules, addr_type):
+        # consecutive rules matching pairwise disjoint networks, which may
+        # thus be evaluated in any order
+        run, bounds = [], []
+        for rule in rules:
+            net = None
+            if rule.chain == chain:
+                net = self.split_net(rule, addr_type)
+            if net is not None:
+                start = int(net.network_address)
+                end = int(net.broadcast_address)
+                pos = bisect(bounds, (start, end))
+                if (pos and bounds[pos - 1][1] >= start
+                        or pos < len(bounds) and bounds[pos][0] <= end):
+                    yield run
+                    run, bounds = [], []
+                    pos = 0
+                bounds.insert(pos, (start, end))
+                run.append((net, rule))
+                continue
+
+            if run:
+                yield run
+                run, bounds = [], []
+            yield [(None, rule)]
+        if run:
+            yield run
+
+    def new_chain(self, parent):
+        while True:
+            self.chain_count += 1
+            name = f'{parent[:20]}-{self.chain_count}'.upper()
+            if name not in self.table.chains:
+                break
+        self.table.add_chain(name, '-')
+        return name
+
+    @staticmethod
+    def move(rule, chain):
+        if rule.chain == chain:
+            return rule
+        nrule = rule.copy()
+        nrule.remove_target(nrule.target(ChainTarget))
+        nrule.add_feature(ChainTarget, chain)
+        return nrule
+
+    @staticmethod
+    def supernet(items):
+        start = int(items[0][0].network_address)
+        end = int(items[-1][0].broadcast_address)
+        plen = 32 - (start ^ end).bit_length()
+        return ipaddress.ip_network((start, plen), strict=False)
+
+    def jump(self, origin, chain, addr_type, net, child):
+        jump = Rule(self.table)
+        jump.node = origin.node
+        jump.add_feature(ChainTarget, chain)
+        jump.add_feature(addr_type, str(net))
+        jump.add_feature(Target, child)
+        jump.check()
+        return jump
+
+    def tree(self, root, chain, items, addr_type):
+        if len(items) <= self.leaf_rules:
+            for net, rule in items:
+                yield self.move(rule, chain)
+            return
+
+        first = int(items[0][0].network_address)
+        last = int(items[-1][0].broadcast_address)
+        mask = 1 << ((first ^ last).bit_length() - 1)
+        for bit in (0, mask):
+            half = [i for i in items if int(i[0].network_address) & mask == bit]
+            if len(half) == 1:
+                yield self.move(half[0][1], chain)
+                continue
+            child = self.new_chain(root)
+            net = self.supernet(half)
+            yield self.jump(half[0][1], chain, addr_type, net, child)
+            yield from self.tree(root, child, half, addr_type)
+
+    def split(self, chain, rules, addr_type):
+        for run in self.runs(chain, rules, addr_type):
+            if len(run) < self.min_rules:
+                yield from (rule for net, rule in run)
+            else:
+                run.sort(key=lambda i: i[0])
+                yield from self.tree(chain, chain, run, addr_type)
+
+    def run_chain(self, chain, rules):
+        for addr_type in self.addr_types:
+            rules = list(self.split(chain, rules, addr_type))
+        return rules
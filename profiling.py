@@ -0,0 +1,117 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import functools
+import os
+import sys
+import time
+import tools
+from features import feature_map
+from scope import Scope, YipScope
+
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+# call counts and times of the compilation steps. Phases, imported files and
+# tables are recorded by the Yip given this object, while features builds,
+# variable formatting and scope lookups are only instrumented while the
+# object is used as a context manager.
+class Timings():
+    def __init__(self):
+        # (category, name) -> [calls, total time, own time]
+        self.stats = {}
+        self.stack = []
+        self.active = {}
+        self.patches = []
+
+    @contextlib.contextmanager
+    def measure(self, category, name):
+        key = (category, name)
+        if self.active.get(key):
+            # only account for the outermost of recursive calls
+            yield
+            return
+
+        self.active[key] = True
+        frame = [0.0]
+        self.stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stack.pop()
+            self.active[key] = False
+            if self.stack:
+                self.stack[-1][0] += elapsed
+            stat = self.stats.setdefault(key, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += elapsed
+            stat[2] += elapsed - frame[0]
+
+    def wrap(self, category, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.measure(category, name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def patch(self, owner, attr, category, name):
+        # inherited methods are patched on the owner, and removed from it
+        # once done
+        func = owner.__dict__.get(attr)
+        self.patches.append((owner, attr, func))
+        setattr(owner, attr, self.wrap(category, name,
+                                       getattr(owner, attr)))
+
+    def patch_function(self, func, category, name):
+        for module in list(sys.modules.values()):
+            mfile = getattr(module, '__file__', None)
+            if not mfile or os.path.dirname(mfile) != _package_dir:
+                continue
+            for attr, value in list(vars(module).items()):
+                if value is func:
+                    self.patch(module, attr, category, name)
+
+    def __enter__(self):
+        features = {}
+        for fname, ftype in feature_map.items():
+            features.setdefault(ftype, []).append(fname)
+        for ftype, fnames in features.items():
+            self.patch(ftype, 'build', 'feature', ', '.join(fnames))
+        self.patch_function(tools.yip_format, 'format', 'yip_format')
+        self.patch(Scope, 'get_vars', 'scope', 'get_vars')
+        self.patch(YipScope, 'get_vars', 'scope', 'get_vars')
+        return self
+
+    def __exit__(self, *exc):
+        for owner, attr, func in reversed(self.patches):
+            if func is None:
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, func)
+        self.patches = []
+
+    def report(self):
+        width = max((len(n) for c, n in self.stats), default=0)
+        yield f'{"":8} {"":{width}} {"calls":>9} {"total":>9} {"own":>9}'
+        for (category, name), (calls, total, own) in sorted(
+            self.stats.items(),
+            key=lambda e: (e[0][0], -e[1][1])
+        ):
+            yield (f'{category:8} {name:{width}} '
+                   f'{calls:9d} {total:9.3f} {own:9.3f}')
@@ -14,9 +14,13 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import ast_nodes
 from ast_nodes import Not
+import features
 from features import feature_map
 from meta import BaseMeta, meta, YipSyntaxError, hasmeta
+from tools import yip_format, yip_format_fields
 
 
 class TypeMap(dict):
@@ -35,6 +39,11 @@ class TypeMap(dict):
 
 
 class Rule(BaseMeta):
+    __slots__ = (
+        'scope', 'table', 'dependencies', 'targets', 'chain', 'rtype',
+        'tokens', 'node', 'line',
+    )
+
     def __meta__(self):
         return meta(self.node)
 
@@ -46,6 +55,52 @@ class Rule(BaseMeta):
         self.chain = None
         self.rtype = rtype
         self.tokens = []
+        self.line = None
+
+    @property
+    def verdict(self):
+        target = self.target(features.Target)
+        return target.value if target else None
+
+    @property
+    def terminal(self):
+        verdict = self.verdict
+        return verdict is not None and verdict not in self.table.local_chains
+
+    def target(self, ttype):
+        for target in self.targets:
+            if type(target) is ttype:
+                return target
+        return None
+
+    def signature(self, *ignored):
+        skip = {
+            id(token)
+            for target in self.targets if type(target) in ignored
+            for token in target.tokens
+        }
+        return (self.rtype, self.chain) + tuple(
+            t[1] for t in self.tokens if id(t) not in skip
+        )
+
+    def copy(self):
+        nrule = copy.copy(self)
+        nrule.dependencies = set(self.dependencies)
+        nrule.targets = list(self.targets)
+        nrule.tokens = list(self.tokens)
+        return nrule
+
+    def remove_target(self, target):
+        self.targets.remove(target)
+        owned = {id(t) for t in target.tokens}
+        self.tokens = [t for t in self.tokens if id(t) not in owned]
+
+    def add_feature(self, ftype, value, negated=False):
+        target = ftype(self, negated=negated)
+        self.targets.append(target)
+        target.build(value)
+        self.tokens.sort(key=lambda x: x[0])
+        return target
 
     def check(self):
         if self.chain is None:
@@ -59,22 +114,103 @@ class Rule(BaseMeta):
         self.node = node
         node_scope = self.scope.rule
         node_scope.get_vars(node, None, self.scope, node_scope, to_rule=True)
+        # bits of the feature types of the rule, and of the types they
+        # conflict with
+        bits = conflicts = 0
+        conflict = False
         for fname, val in node_scope.items():
-            if fname not in feature_map:
+            ftype = feature_map.get(fname)
+            if ftype is None:
                 raise YipSyntaxError(fname, f'Unknown feature: {fname}')
+            if bits & ftype.conflict_mask or conflicts & ftype.bit:
+                conflict = True
+            bits |= ftype.bit
+            conflicts |= ftype.conflict_mask
 
             isnot = isinstance(val, Not)
-            target = feature_map[fname](self, negated=isnot)
+            target = ftype(self, negated=isnot)
             self.targets.append(target)
             target.build(val.value if isnot else val)
 
-        tm = TypeMap(self.targets)
-        for target in self.targets:
-            target.check(tm)
+        if conflict:
+            # find the conflicting targets to report
+            tm = TypeMap(self.targets)
+            for target in self.targets:
+                target.check(tm)
 
         self.tokens.sort(key=lambda x: x[0])
         self.check()
 
+    # only keep the rendered line, the rule can't be inspected or modified
+    # afterwards
+    def compact(self):
+        self.line = self.render()
+        self.scope = None
+        self.dependencies = None
+        self.targets = None
+        self.tokens = None
+
     def render(self):
+        if self.line is not None:
+            return self.line
         tokens = ' '.join(t[1] for t in self.tokens)
         return f'{self.rtype} {self.chain} {tokens}'
+
+
+def _fields(value):
+    return yip_format_fields(value.value if isinstance(value, Not) else value)
+
+
+# rule of a with_items loop, compiled from the rule built for its first item.
+# Targets of the features which don't use the loop variables are shared by
+# the rules built for the next items, only the other ones are rebuilt. As
+# the feature types don't change, neither do the conflict checks.
+class RuleTemplate():
+    def __init__(self, rule, keys):
+        self.rule = rule
+        # (shared target, feature type, value, whether the rule formats it)
+        self.features = []
+        raw = {
+            k.value if isinstance(k, ast_nodes.Rule) else k: v
+            for k, v in rule.node.items()
+        }
+        for (fname, value), target in zip(rule.scope.rule.items(),
+                                          rule.targets):
+            # rules only format the values of their own node, values
+            # inherited from blocks are only formatted by the features
+            if fname in raw and _fields(raw[fname]) & keys:
+                self.features.append((None, type(target), raw[fname], True))
+            elif _fields(value):
+                self.features.append((None, type(target), value, False))
+            else:
+                self.features.append((target, type(target), None, False))
+
+    @classmethod
+    def compile(cls, rule, keys):
+        if any(isinstance(k, ast_nodes.IfDef) for k in rule.node):
+            return None
+        return cls(rule, keys)
+
+    def build(self, scope):
+        proto = self.rule
+        rule = Rule(proto.table, scope, proto.rtype)
+        rule.node = proto.node
+        rule.chain = proto.chain
+        for target, ftype, value, fmt in self.features:
+            if target is None:
+                isnot = isinstance(value, Not)
+                if isnot:
+                    value = value.value
+                if fmt:
+                    value = yip_format(rule.scope, value)
+                target = ftype(rule, negated=isnot)
+                rule.targets.append(target)
+                target.build(value)
+            else:
+                rule.targets.append(target)
+                rule.tokens.extend(target.tokens)
+                rule.dependencies.update(target.deps)
+
+        rule.tokens.sort(key=lambda x: x[0])
+        rule.check()
+        return rule
@@ -0,0 +1,140 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ipaddress
+import re
+import shlex
+from meta import Meta, YipSyntaxError
+
+_counters = re.compile(r'^\[(\d+):(\d+)\]\s*')
+
+_option_aliases = {
+    '--protocol': '-p',
+    '--source': '-s',
+    '--destination': '-d',
+    '--in-interface': '-i',
+    '--out-interface': '-o',
+    '--jump': '-j',
+    '--source-port': '--sport',
+    '--destination-port': '--dport',
+    '--source-ports': '--sports',
+    '--destination-ports': '--dports',
+    '--ctstate': '--state',
+}
+
+_implicit_options = {
+    ('--reject-with', 'icmp-port-unreachable'),
+}
+
+
+def _normalize_value(opt, value):
+    if opt in ('-s', '-d'):
+        try:
+            return str(ipaddress.ip_network(value, strict=False))
+        except ValueError:
+            return value
+    if opt == '--state':
+        return ','.join(sorted(value.upper().split(',')))
+    if opt == '-p':
+        return value.lower()
+    return value
+
+
+def signature(words):
+    options = []
+    negated = False
+    words = iter(words)
+    for word in words:
+        if word == '!':
+            if options and not options[-1][2]:
+                options[-1][1] = True
+            else:
+                negated = True
+        elif word == '-m':
+            next(words, None)
+        elif word.startswith('-') and not word[1:2].isdigit():
+            options.append([_option_aliases.get(word, word), negated, []])
+            negated = False
+        elif options:
+            options[-1][2].append(word)
+
+    res = []
+    for opt, neg, values in options:
+        value = _normalize_value(opt, ' '.join(values))
+        if (opt, value) not in _implicit_options:
+            res.append((opt, neg, value))
+    return tuple(sorted(res))
+
+
+def rule_signature(rule):
+    return signature(shlex.split(rule.render())[2:])
+
+
+class SavedRule():
+    def __init__(self, meta, chain, words, line, packets=0, nbytes=0):
+        self.meta = meta
+        self.chain = chain
+        self.line = line
+        self.packets = packets
+        self.bytes = nbytes
+        self.signature = signature(words)
+
+
+class SavedTable():
+    def __init__(self, name):
+        self.name = name
+        self.chains = {}
+        self.rules = {}
+
+
+def parse(fd):
+    name = getattr(fd, 'name', '<save>')
+    tables = {}
+    table = None
+    for lnum, line in enumerate(fd, 1):
+        line = line.strip()
+        lmeta = Meta(name, lnum, 1)
+        if not line or line.startswith('#'):
+            continue
+
+        packets = nbytes = 0
+        match = _counters.match(line)
+        if match:
+            packets, nbytes = map(int, match.groups())
+            line = line[match.end():]
+
+        if line.startswith('*'):
+            table = tables[line[1:]] = SavedTable(line[1:])
+        elif table is None:
+            raise YipSyntaxError(lmeta, 'Rule outside of a table')
+        elif line == 'COMMIT':
+            table = None
+        elif line.startswith(':'):
+            chain, policy = line[1:].split()[:2]
+            table.chains[chain] = policy
+        else:
+            words = shlex.split(line)
+            if len(words) < 2 or words[0] != '-A':
+                raise YipSyntaxError(lmeta, f'Unsupported line: {line}')
+            table.rules.setdefault(words[1], []).append(
+                SavedRule(lmeta, words[1], words[2:], line, packets, nbytes)
+            )
+    return tables
+
+
+def load(path):
+    with open(path) as f:
+        return parse(f)
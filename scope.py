@@ -1,12 +1,77 @@
 
-from collections import ChainMap
+from collections.abc import MutableMapping
 from tools import yip_ld_iter, yip_format
 from ast_nodes import Not, Rule, IfDef
 
 
-class Scope(ChainMap):
+# a scope is a flat, shared snapshot of the enclosing scopes plus the
+# variables defined locally, which lookups check first. Iteration follows the
+# order of a ChainMap of the same maps, the first of which receives writes.
+# Snapshots are never modified, so sub scopes don't see the later writes to
+# their parent.
+class Scope(MutableMapping):
+    # variables get_vars doesn't redefine
+    fixed = frozenset()
+
+    def __init__(self, *maps, fixed=()):
+        if fixed:
+            self.fixed = frozenset(fixed)
+        self.local = maps[0] if maps else {}
+        self.base = {}
+        for m in reversed(maps[1:]):
+            self.base.update(m)
+        self.flat = None
+
+    def snapshot(self):
+        if not self.local:
+            return self.base
+        if self.flat is None:
+            self.flat = {**self.base, **self.local}
+        return self.flat
+
     def sub_scope(self, local=None):
-        return self.new_child(local)
+        nscope = self.__class__.__new__(self.__class__)
+        nscope.local = {} if local is None else local
+        nscope.base = self.snapshot()
+        nscope.flat = None
+        if self.fixed:
+            nscope.fixed = self.fixed
+        return nscope
+
+    def __getitem__(self, key):
+        local = self.local
+        if key in local:
+            return local[key]
+        return self.base[key]
+
+    def get(self, key, default=None):
+        local = self.local
+        if key in local:
+            return local[key]
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.local or key in self.base
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+        self.flat = None
+
+    def __delitem__(self, key):
+        del self.local[key]
+        self.flat = None
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self.snapshot())
+
+    def items(self):
+        return self.snapshot().items()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.snapshot()!r})'
 
     def get_vars(self, node, attr='vars', vars=None, rules=None, to_rule=False):
         if attr is not None:
@@ -34,6 +99,8 @@ class Scope(ChainMap):
                     scope.get_vars(sub_block, None, vars, rules, to_rule)
                 continue
 
+            if k in scope.fixed:
+                continue
             if isinstance(v, Not):
                 v = v.value
                 tr = Not
@@ -44,8 +111,8 @@ class Scope(ChainMap):
 
 
 class YipScope(Scope):
-    def __init__(self, *maps, rules=None):
-        super().__init__(*maps)
+    def __init__(self, *maps, rules=None, fixed=()):
+        super().__init__(*maps, fixed=fixed)
         self.rule = Scope(*(rules if rules else {}))
 
     def sub_scope(self, local=None, rlocal=None):
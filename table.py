@@ -14,8 +14,11 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from ast_nodes import DictNode
+from features import SAddr, DAddr
 from meta import BaseMeta, meta, YipSyntaxError, hasmeta
-from rule import Rule
+from rule import Rule, RuleTemplate
+from passes import pass_map
 from tools import (
     yip_flatten_iter,
     yip_dict_format,
@@ -40,6 +43,11 @@ class Table(BaseMeta):
         self.chains = default_chains.sub_scope(local=self.local_chains)
         self.name = name
         self.rules = []
+        # rules built while the table is rendered, see build
+        self.lazy_rules = None
+        self.ipsets = {}
+        # passes need the targets of every rule of the table
+        self.compact = yip.compact and not yip.passes
 
     def add_chain(self, chain, policy):
         if chain in self.chains:
@@ -49,10 +57,50 @@ class Table(BaseMeta):
             )
         self.chains[chain] = policy
 
-    def add_rule(self, rule_node, scope=None):
-        rule = Rule(self, scope)
-        self.rules.append(rule)
+    def build_rule(self, rule_node, scope=None):
+        # rules write their features to their scope, which mustn't be shared
+        # with the following rules of the block
+        rule = Rule(self, (self.scope if scope is None else scope).sub_scope())
         rule.build(rule_node)
+        return self.finish_rule(rule)
+
+    # rules of a loop are built from a template compiled from its first
+    # item, one per set of item keys
+    def build_loop_rule(self, rule_node, scope, keys, templates):
+        template = templates.get(keys)
+        if template is not None:
+            rule = template.build(scope)
+        else:
+            rule = Rule(self, scope)
+            rule.build(rule_node)
+            if keys not in templates:
+                templates[keys] = RuleTemplate.compile(rule, keys)
+        return self.finish_rule(rule)
+
+    # rules matching several addresses are split into one rule per address,
+    # in the order iptables-restore expands them, so that they can be found
+    # in iptables-save dumps
+    def finish_rule(self, rule):
+        rules = [rule]
+        for addr_type in (SAddr, DAddr):
+            target = rule.target(addr_type)
+            if target is None or ',' not in target.value:
+                continue
+            split = []
+            for srule in rules:
+                for addr in target.value.split(','):
+                    nrule = srule.copy()
+                    nrule.remove_target(nrule.target(addr_type))
+                    nrule.add_feature(addr_type, addr, target.negated)
+                    split.append(nrule)
+            rules = split
+        if self.compact:
+            for srule in rules:
+                srule.compact()
+        return rules
+
+    def add_rule(self, rule_node, scope=None):
+        self.rules.extend(self.build_rule(rule_node, scope))
 
     def build_chains(self, node):
         self.node = node
@@ -69,14 +117,24 @@ class Table(BaseMeta):
         for rule_node in node:
             assert(isinstance(rule_node, dict))
             if 'with_items' in rule_node:
+                # the node may be shared with other import sites
+                rule_node = DictNode(rule_node)
                 item_list = rule_node.pop('with_items')
-                for item in yip_flatten_iter(item_list):
-                    nitem = yip_format(scope, item)
+                templates = {}
+                # items may be variables holding lists
+                items = (
+                    nitem
+                    for item in yip_flatten_iter(item_list)
+                    for nitem in yip_flatten_iter(yip_format(scope, item))
+                )
+                for nitem in items:
                     if isinstance(nitem, str):
                         nitem = {'item': nitem}
                     assert(isinstance(nitem, dict))
                     nscope = scope.sub_scope(nitem)
-                    self.add_rule(rule_node, nscope)
+                    yield from self.build_loop_rule(
+                        rule_node, nscope, frozenset(nitem), templates
+                    )
                 continue
 
             if 'block' in rule_node:
@@ -88,26 +146,58 @@ class Table(BaseMeta):
                     )
                 nscope = scope.sub_scope()
                 nscope.get_vars(rule_node, attr='block')
-                self.build_rules(subrules, nscope)
+                yield from self.build_rules(subrules, nscope)
             else:
-                self.add_rule(rule_node, scope)
+                yield from self.build_rule(rule_node, scope)
 
-    def build(self, node):
+    # lazy tables only build their rules one at a time while being rendered,
+    # without keeping them
+    def build(self, node, lazy=False):
         assert(hasmeta(node))
         chains_node = node.get('chains')
         if chains_node:
             self.build_chains(chains_node)
 
         rules_node = node.get('rules')
-        if rules_node:
-            self.build_rules(rules_node, self.scope)
+        if not rules_node:
+            return
+        rules = self.build_rules(rules_node, self.scope)
+        if lazy:
+            self.lazy_rules = rules
+        else:
+            self.rules.extend(rules)
+
+    def optimize(self, passes):
+        for pname, pass_class in pass_map.items():
+            if pname in passes:
+                pass_class(self).run()
+
+    def compact_rules(self):
+        for rule in self.rules:
+            rule.compact()
+
+    def render_lines(self):
+        yield f'*{self.name}'
+        if not self.local_chains:
+            yield ''
+        for c, pol in self.local_chains.items():
+            yield f':{c} {pol} [0:0]'
+        yield ''
+        empty = True
+        for r in self.rules:
+            empty = False
+            yield r.render()
+        if self.lazy_rules is not None:
+            for r in self.lazy_rules:
+                empty = False
+                yield r.render()
+        if empty:
+            yield ''
+        yield ''
+        yield 'COMMIT'
 
     def render(self):
-        chains = '\n'.join(
-            f':{c} {pol} [0:0]' for c, pol in self.local_chains.items()
-        )
-        rules = '\n'.join(r.render() for r in self.rules)
-        return f'*{self.name}\n{chains}\n\n{rules}\n\nCOMMIT'
+        return '\n'.join(self.render_lines())
 
 
 default_tables = {}
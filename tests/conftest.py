@@ -0,0 +1,46 @@
+import os
+import sys
+import textwrap
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yiptable import Yip  # noqa: E402
+
+examples_dir = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples'
+)
+
+
+# builds a Yip from the given source, written to main.yml
+@pytest.fixture
+def make_yip(tmp_path):
+    def make_yip(text, **options):
+        path = tmp_path / 'main.yml'
+        path.write_text(textwrap.dedent(text))
+        return Yip(str(path), **options)
+    return make_yip
+
+
+FILTER = '''\
+filter:
+  chains:
+    INPUT: DROP
+    USER: RETURN
+  rules:
+    - block:
+        !rule chain: INPUT
+      rules:
+'''
+
+
+# rule lines of a filter table holding the given INPUT rules
+@pytest.fixture
+def rule_lines(make_yip):
+    def rule_lines(text, passes=(), **options):
+        yip = make_yip(
+            FILTER + textwrap.indent(textwrap.dedent(text), ' ' * 8),
+            passes=list(passes), **options
+        )
+        return [line for line in yip.render_lines() if line.startswith('-A')]
+    return rule_lines
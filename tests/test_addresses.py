@@ -0,0 +1,54 @@
+import io
+import save
+
+CONFIG = '''
+vars:
+  - allow: [10.0.0.0/25, 10.0.0.128/25, 10.0.1.0/24, 192.168.1.1]
+filter:
+  chains:
+    INPUT: DROP
+  rules:
+    - block:
+        !rule chain: INPUT
+      rules:
+        - target: ACCEPT
+          saddr: '{allow}'
+          daddr: [1.1.1.1, 2.2.2.2]
+'''
+
+
+def test_address_lists_are_collapsed_and_split(make_yip):
+    lines = [
+        line for line in make_yip(CONFIG).render_lines()
+        if line.startswith('-A')
+    ]
+    assert lines == [
+        '-A INPUT -j ACCEPT -s 10.0.0.0/23 -d 1.1.1.1/32',
+        '-A INPUT -j ACCEPT -s 10.0.0.0/23 -d 2.2.2.2/32',
+        '-A INPUT -j ACCEPT -s 192.168.1.1/32 -d 1.1.1.1/32',
+        '-A INPUT -j ACCEPT -s 192.168.1.1/32 -d 2.2.2.2/32',
+    ]
+
+
+def test_negated_address_list(make_yip):
+    yip = make_yip(CONFIG.replace("saddr: '{allow}'", "saddr: !not '{neg}'")
+                   .replace('  - allow:', '  - neg: [1.1.1.0/32, 1.1.1.1]\n'
+                            '  - allow:'))
+    assert '! -s 1.1.1.0/31' in yip.render()
+
+
+def test_delta_against_the_expanded_dump_is_empty(make_yip):
+    yip = make_yip(CONFIG)
+    # as iptables-save lists the rules of -s a,b -d c,d
+    live = save.parse(io.StringIO(
+        '*filter\n'
+        ':INPUT DROP [0:0]\n'
+        '-A INPUT -s 10.0.0.0/23 -d 1.1.1.1/32 -j ACCEPT\n'
+        '-A INPUT -s 10.0.0.0/23 -d 2.2.2.2/32 -j ACCEPT\n'
+        '-A INPUT -s 192.168.1.1/32 -d 1.1.1.1/32 -j ACCEPT\n'
+        '-A INPUT -s 192.168.1.1/32 -d 2.2.2.2/32 -j ACCEPT\n'
+        'COMMIT\n'
+    ))
+    assert list(yip.render_delta_lines(live)) == [
+        '# apply with iptables-restore --noflush'
+    ]
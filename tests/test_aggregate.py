@@ -0,0 +1,32 @@
+def test_address_loop_is_collapsed(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          saddr: '10.0.{item}.0/24'
+          with_items: [0, 1, 2, 3, 8]
+        - target: DROP
+          saddr: 10.0.4.0/24
+    ''', passes=['aggregate'])
+    assert lines == [
+        '-A INPUT -j ACCEPT -s 10.0.0.0/22',
+        '-A INPUT -j ACCEPT -s 10.0.8.0/24',
+        '-A INPUT -j DROP -s 10.0.4.0/24',
+    ]
+
+
+def test_disjoint_networks_are_kept(rule_lines):
+    text = '''
+        - target: ACCEPT
+          saddr: '{item}'
+          with_items: [10.0.0.0/24, 10.0.2.0/24]
+    '''
+    assert rule_lines(text, passes=['aggregate']) == rule_lines(text)
+
+
+def test_overlapping_jumps_are_kept(rule_lines):
+    # a packet of 10.1.1.0/24 jumps to USER twice
+    text = '''
+        - target: USER
+          saddr: '{item}'
+          with_items: [10.1.0.0/16, 10.1.1.0/24]
+    '''
+    assert rule_lines(text, passes=['aggregate']) == rule_lines(text)
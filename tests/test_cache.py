@@ -0,0 +1,16 @@
+from cache import ParseCache, read_source
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    source = tmp_path / 'main.yml'
+    source.write_text('filter: {}\n')
+    fdigest = read_source(str(source))[1]
+    cache = ParseCache(str(tmp_path / 'cache'))
+    cache.put(str(source), fdigest, {'filter': {}}, [])
+    assert cache.get(str(source), fdigest) == ({'filter': {}}, [])
+
+    path = cache.entry_path(str(source), fdigest)
+    # a pickle of a global which doesn't exist anymore
+    with open(path, 'wb') as f:
+        f.write(b'cmeta\nGone\n.')
+    assert cache.get(str(source), fdigest) is None
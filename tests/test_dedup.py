@@ -0,0 +1,41 @@
+import logging
+
+
+def test_terminal_duplicate_is_dropped(rule_lines, caplog):
+    with caplog.at_level(logging.WARNING):
+        lines = rule_lines('''
+            - target: ACCEPT
+              proto: tcp
+              dport: 22
+            - target: DROP
+              saddr: 10.0.0.1
+            - target: ACCEPT
+              dport: 22
+              proto: tcp
+        ''', passes=['dedup'])
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp --dport 22',
+        '-A INPUT -j DROP -s 10.0.0.1',
+    ]
+    assert 'duplicate of the rule' in caplog.text
+
+
+def test_non_terminal_duplicate_is_kept(rule_lines):
+    # each jump to USER may have side effects, such as logging
+    text = '''
+        - target: USER
+          proto: tcp
+        - target: USER
+          proto: tcp
+    '''
+    assert rule_lines(text, passes=['dedup']) == rule_lines(text)
+
+
+def test_different_verdicts_are_kept(rule_lines):
+    text = '''
+        - target: ACCEPT
+          proto: tcp
+        - target: DROP
+          proto: tcp
+    '''
+    assert rule_lines(text, passes=['dedup']) == rule_lines(text)
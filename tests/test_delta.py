@@ -0,0 +1,78 @@
+import io
+
+import save
+from conftest import FILTER
+
+RULES = FILTER + '''\
+        - target: ACCEPT
+          saddr: 10.0.0.1
+        - target: USER
+          proto: tcp
+          dport: 22
+'''
+
+
+def live_dump(text):
+    return save.parse(io.StringIO(text))
+
+
+def test_unchanged_ruleset_is_empty(make_yip):
+    yip = make_yip(RULES)
+    live = live_dump(yip.render())
+    assert list(yip.render_delta_lines(live)) == [
+        '# apply with iptables-restore --noflush'
+    ]
+
+
+def test_rewritten_rule_is_applied(make_yip):
+    yip = make_yip(RULES)
+    live = live_dump(yip.render().replace('10.0.0.1', '10.0.0.2'))
+    lines = list(yip.render_delta_lines(live))
+    assert '-F INPUT' in lines
+    assert '-A INPUT -j ACCEPT -s 10.0.0.1' in lines
+    # USER didn't change
+    assert '-F USER' not in lines
+
+
+def test_undeclared_builtin_keeps_its_policy(make_yip):
+    yip = make_yip('''\
+        filter:
+          rules:
+            - chain: OUTPUT
+              target: ACCEPT
+              oface: lo
+    ''')
+    live = live_dump('*filter\n:OUTPUT DROP [0:0]\nCOMMIT\n')
+    lines = list(yip.render_delta_lines(live))
+    assert not any(line.startswith(':OUTPUT') for line in lines)
+    assert '-A OUTPUT -j ACCEPT -o lo' in lines
+
+
+def test_stale_chains_are_deleted(make_yip):
+    yip = make_yip(RULES)
+    live = live_dump(yip.render().replace(
+        'COMMIT', ':OLD - [0:0]\n-A OLD -j DROP\nCOMMIT'
+    ))
+    lines = list(yip.render_delta_lines(live))
+    assert lines[-3:] == ['-F OLD', '-X OLD', 'COMMIT']
+
+
+def test_signature_ignores_save_formatting():
+    table = live_dump(
+        '*filter\n'
+        '-A INPUT -s 10.0.0.1 -p tcp -m tcp --dport 22 -j ACCEPT\n'
+        '[3:120] -A INPUT --protocol TCP --destination-port 22 '
+        '--source 10.0.0.1/32 --jump ACCEPT\n'
+        'COMMIT\n'
+    )['filter']
+    first, second = table.rules['INPUT']
+    assert first.signature == second.signature
+    assert (second.packets, second.bytes) == (3, 120)
+
+
+def test_signature_matches_rendered_rules(make_yip):
+    yip = make_yip(RULES)
+    live = live_dump(yip.render())['filter'].rules
+    rules = yip.tables['filter'].rules
+    saved = [r.signature for chain in live.values() for r in chain]
+    assert [save.rule_signature(rule) for rule in rules] == saved
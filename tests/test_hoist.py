@@ -0,0 +1,45 @@
+import logging
+
+
+def test_established_rule_is_hoisted(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          proto: tcp
+          dport: 22
+        - target: DROP
+          saddr: 10.0.0.0/8
+          proto: udp
+        - target: ACCEPT
+          state: [ESTABLISHED, RELATED]
+          saddr: 192.168.0.0/16
+    ''', passes=['hoist'])
+    assert lines == [
+        '-A INPUT -j ACCEPT -m state --state ESTABLISHED,RELATED '
+        '-s 192.168.0.0/16',
+        '-A INPUT -j ACCEPT -p tcp --dport 22',
+        '-A INPUT -j DROP -p udp -s 10.0.0.0/8',
+    ]
+
+
+def test_blocked_rule_stays(rule_lines, caplog):
+    # established packets of 10.0.0.0/8 are dropped before being accepted
+    text = '''
+        - target: DROP
+          saddr: 10.0.0.0/8
+        - target: ACCEPT
+          state: [ESTABLISHED, RELATED]
+    '''
+    with caplog.at_level(logging.WARNING):
+        assert rule_lines(text, passes=['hoist']) == rule_lines(text)
+    assert 'not hoisted' in caplog.text
+
+
+def test_new_connections_stay(rule_lines):
+    text = '''
+        - target: ACCEPT
+          proto: tcp
+        - target: ACCEPT
+          state: [NEW]
+          proto: udp
+    '''
+    assert rule_lines(text, passes=['hoist']) == rule_lines(text)
@@ -0,0 +1,43 @@
+def test_address_loop_becomes_a_set(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          saddr: '{item}'
+          with_items: [10.0.0.1, 10.0.0.2, 10.0.1.0/24]
+    ''', passes=['ipset'])
+    assert lines == ['-A INPUT -j ACCEPT -m set --match-set yip-filter-0 src']
+
+
+def test_overlapping_jumps_are_kept(rule_lines):
+    # a packet of 10.1.1.0/24 jumps to USER twice
+    text = '''
+        - target: USER
+          saddr: '{item}'
+          with_items: [10.1.0.0/16, 10.1.1.0/24]
+        - target: DROP
+          saddr: 10.2.0.1
+    '''
+    assert rule_lines(text, passes=['ipset']) == rule_lines(text)
+
+
+def test_restore_script_swaps_the_sets(make_yip):
+    yip = make_yip('''
+        filter:
+          chains:
+            INPUT: DROP
+          rules:
+            - chain: INPUT
+              target: ACCEPT
+              daddr: '{item}'
+              with_items: [10.0.0.1, 10.0.0.2]
+    ''', passes=['ipset'])
+    assert '--match-set yip-filter-0 dst' in yip.render()
+    options = 'hash:net family inet maxelem 16777216'
+    assert yip.render_ipsets().split('\n') == [
+        f'create yip-filter-0 {options} -exist',
+        f'create yip-filter-0-new {options} -exist',
+        'flush yip-filter-0-new',
+        'add yip-filter-0-new 10.0.0.1/32',
+        'add yip-filter-0-new 10.0.0.2/32',
+        'swap yip-filter-0-new yip-filter-0',
+        'destroy yip-filter-0-new',
+    ]
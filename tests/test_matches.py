@@ -0,0 +1,151 @@
+import textwrap
+from matches import IntervalSet, IfaceSet, MatchSpace, commute
+from yiptable import Yip
+
+
+# rules of the INPUT chain of a filter table holding the given rules
+def rules(tmp_path, text):
+    path = tmp_path / 'main.yml'
+    path.write_text(
+        'filter:\n'
+        '  chains:\n'
+        '    INPUT: ACCEPT\n'
+        '    USER: RETURN\n'
+        '  rules:\n'
+        '    - block:\n'
+        '        !rule chain: INPUT\n'
+        '      rules:\n'
+        + textwrap.indent(textwrap.dedent(text), '        ')
+    )
+    yip = Yip(str(path))
+    yip._build()
+    return yip.tables['filter'].rules
+
+
+def spaces(tmp_path, text):
+    return [MatchSpace(r) for r in rules(tmp_path, text)]
+
+
+def test_interval_set_merges_adjacent_intervals():
+    s = IntervalSet([(5, 9), (0, 4), (20, 30), (25, 40)], (0, 100))
+    assert s.intervals == [(0, 9), (20, 40)]
+
+
+def test_interval_set_complement():
+    s = IntervalSet([(0, 9), (20, 40)], (0, 100))
+    assert s.complement().intervals == [(10, 19), (41, 100)]
+    assert IntervalSet([], (0, 100)).complement().isfull()
+    assert not IntervalSet([(0, 99)], (0, 100)).isfull()
+
+
+def test_interval_set_relations():
+    a = IntervalSet([(0, 9)], (0, 100))
+    b = IntervalSet([(10, 19)], (0, 100))
+    c = IntervalSet([(0, 19)], (0, 100))
+    assert a.isdisjoint(b)
+    assert not a.isdisjoint(c)
+    assert a.issubset(c)
+    assert not c.issubset(a)
+    assert IntervalSet([], (0, 100)).issubset(a)
+
+
+def test_iface_set_wildcards():
+    eth = IfaceSet('eth+')
+    eth0 = IfaceSet('eth0')
+    lo = IfaceSet('lo')
+    assert eth0.issubset(eth)
+    assert not eth.issubset(eth0)
+    assert eth0.isdisjoint(lo)
+    assert not eth0.isdisjoint(eth)
+    assert IfaceSet('+').isfull()
+    assert not eth.isfull()
+
+
+def test_iface_set_negation():
+    not_eth0 = IfaceSet('eth0', negated=True)
+    assert IfaceSet('eth0').isdisjoint(not_eth0)
+    assert IfaceSet('lo').issubset(not_eth0)
+    assert not IfaceSet('eth+').issubset(not_eth0)
+    assert IfaceSet('eth+', negated=True).issubset(not_eth0)
+    assert not not_eth0.isdisjoint(IfaceSet('lo', negated=True))
+
+
+def test_superset(tmp_path):
+    wide, narrow = spaces(tmp_path, '''
+        - target: DROP
+          saddr: 10.0.0.0/8
+        - target: DROP
+          saddr: 10.1.0.0/16
+          proto: tcp
+          dport: 22
+    ''')
+    assert wide.issuperset(narrow)
+    assert not narrow.issuperset(wide)
+
+
+def test_superset_needs_every_field(tmp_path):
+    ssh, any_port = spaces(tmp_path, '''
+        - target: DROP
+          proto: tcp
+          dport: 22
+        - target: DROP
+          proto: tcp
+    ''')
+    assert not ssh.issuperset(any_port)
+    assert any_port.issuperset(ssh)
+
+
+def test_negated_icmp_all_matches_nothing(tmp_path):
+    nothing, ping = spaces(tmp_path, '''
+        - target: DROP
+          proto: icmp
+          icmp-type: !not all
+        - target: DROP
+          proto: icmp
+          icmp-type: 8
+          iface: eth0
+    ''')
+    assert not nothing.issuperset(ping)
+    assert nothing.isdisjoint(ping)
+
+
+def test_disjoint(tmp_path):
+    a, b, c = spaces(tmp_path, '''
+        - target: ACCEPT
+          proto: tcp
+          dport: 22
+        - target: DROP
+          proto: tcp
+          dport: 80
+        - target: DROP
+          saddr: 10.0.0.1
+    ''')
+    assert a.isdisjoint(b)
+    assert not a.isdisjoint(c)
+
+
+def test_commute(tmp_path):
+    ssh, web, block, accept, jump = rules(tmp_path, '''
+        - target: ACCEPT
+          proto: tcp
+          dport: 22
+        - target: DROP
+          proto: tcp
+          dport: 80
+        - target: DROP
+          saddr: 10.0.0.1
+        - target: ACCEPT
+          saddr: 10.0.0.2
+        - target: USER
+          proto: tcp
+          dport: 22
+    ''')
+    # disjoint matches
+    assert commute(ssh, web)
+    # overlapping matches with different outcomes
+    assert not commute(ssh, block)
+    # overlapping matches with the same terminal outcome
+    assert commute(ssh, accept)
+    # jumps to user chains aren't terminal
+    assert not commute(ssh, jump)
+    assert commute(web, jump)
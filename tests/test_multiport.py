@@ -0,0 +1,39 @@
+def test_port_loop_is_merged(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          proto: tcp
+          dport: '{item}'
+          with_items: [22, 80, 443, '8000:8080']
+        - target: DROP
+          proto: tcp
+          dport: 25
+    ''', passes=['multiport'])
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp -m multiport --dports 22,80,443,8000:8080',
+        '-A INPUT -j DROP -p tcp --dport 25',
+    ]
+
+
+def test_rules_are_split_at_15_ports(rule_lines):
+    ports = list(range(1, 20))
+    lines = rule_lines(f'''
+        - target: ACCEPT
+          proto: tcp
+          dport: '{{item}}'
+          with_items: {ports}
+    ''', passes=['multiport'])
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp -m multiport --dports '
+        + ','.join(map(str, range(1, 16))),
+        '-A INPUT -j ACCEPT -p tcp -m multiport --dports 16,17,18,19',
+    ]
+
+
+def test_overlapping_jumps_are_kept(rule_lines):
+    text = '''
+        - target: USER
+          proto: tcp
+          dport: '{item}'
+          with_items: ['1000:2000', '1500:2500']
+    '''
+    assert rule_lines(text, passes=['multiport']) == rule_lines(text)
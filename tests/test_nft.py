@@ -0,0 +1,142 @@
+import os
+from conftest import examples_dir
+from yiptable import Yip
+
+
+def render(make_yip, text, **options):
+    return make_yip(text, backend='nft', **options).render()
+
+
+def test_example():
+    yip = Yip(os.path.join(examples_dir, 'example.yml'), backend='nft')
+    script = yip.render()
+    assert script.startswith('#!/usr/sbin/nft -f\n')
+    assert 'table ip filter {' in script
+    assert 'type filter hook input priority 0; policy accept;' in script
+    assert 'type nat hook postrouting priority 100; policy accept;' in script
+    assert 'tcp dport { 22, 80, 443 } accept' in script
+    assert 'icmp type { 0, 8 } accept' in script
+
+
+def test_nat_statements():
+    yip = Yip(os.path.join(examples_dir, 'example.yml'), backend='nft')
+    script = yip.render()
+    assert ('ip daddr 42.42.42.41 tcp dport { 3306, 4242-4244 } '
+            'dnat to 42.42.42.41') in script
+    # port mappings need a single transport protocol
+    assert 'ip protocol { tcp, udp }' not in script
+    for proto in ('tcp', 'udp'):
+        assert (f'ip protocol {proto} ip saddr 42.42.42.41 oifname "eth0" '
+                'snat to 42.42.42.42:1024-65535') in script
+    assert ('ip saddr 42.42.42.41 oifname "eth0" snat to 42.42.42.42 '
+            'comment') in script
+
+
+FILTER = '''
+filter:
+  chains:
+    INPUT: DROP
+  rules:
+    - block:
+        !rule chain: INPUT
+      rules:
+'''
+
+
+def rules(text):
+    return FILTER + '\n'.join(
+        '        ' + line for line in text.strip('\n').split('\n')
+    ) + '\n'
+
+
+def test_nat_without_ports_merges_protocols(make_yip):
+    script = render(make_yip, '''
+nat:
+  chains:
+    POSTROUTING: ACCEPT
+  rules:
+    - chain: POSTROUTING
+      target: SNAT
+      proto: '{item}'
+      to-saddr: 1.2.3.4
+      with_items: [tcp, udp]
+''')
+    assert 'ip protocol { tcp, udp } snat to 1.2.3.4' in script
+
+
+def test_anonymous_sets(make_yip):
+    script = render(make_yip, rules('''
+- target: ACCEPT
+  saddr: '{item}'
+  with_items: [10.0.0.0/24, 10.0.1.0/24]
+- target: DROP
+  saddr: '{item}'
+  with_items: [10.1.0.0/16, 10.1.1.0/24]
+'''))
+    assert 'ip saddr { 10.0.0.0/24, 10.0.1.0/24 } accept' in script
+    # overlapping networks can't be set elements
+    assert 'ip saddr 10.1.0.0/16 drop' in script
+    assert 'ip saddr 10.1.1.0/24 drop' in script
+
+
+def test_named_sets(make_yip):
+    script = render(make_yip, rules('''
+- target: ACCEPT
+  saddr: '{item}'
+  with_items: [10.0.0.1, 10.0.0.2, 10.0.0.3]
+'''), passes=['ipset'])
+    assert 'set yip-filter-0 {' in script
+    assert 'elements = { 10.0.0.1/32, 10.0.0.2/32, 10.0.0.3/32 }' in script
+    assert 'ip saddr @yip-filter-0 accept' in script
+
+
+def test_verdict_map(make_yip):
+    script = render(make_yip, rules('''
+- target: ACCEPT
+  iface: eth0
+- target: DROP
+  iface: eth1
+- target: ACCEPT
+  iface: eth2
+'''))
+    assert ('iifname vmap { "eth0" : accept, "eth1" : drop, '
+            '"eth2" : accept }') in script
+
+
+def test_verdict_map_needs_exact_names(make_yip):
+    script = render(make_yip, rules('''
+- target: ACCEPT
+  iface: eth+
+- target: DROP
+  iface: lo
+'''))
+    assert 'vmap' not in script
+    assert 'iifname "eth*" accept' in script
+
+
+def test_negation(make_yip):
+    script = render(make_yip, rules('''
+- target: DROP
+  saddr: !not 10.0.0.0/8
+  iface: !not lo
+  proto: !not tcp
+'''))
+    assert ('ip saddr != 10.0.0.0/8 iifname != "lo" ip protocol != tcp '
+            'drop') in script
+
+
+def test_negated_icmp_all_never_matches(make_yip):
+    script = render(make_yip, rules('''
+- target: DROP no icmp at all
+  proto: icmp
+  icmp-type: !not all
+- target: ACCEPT any icmp
+  proto: icmp
+  icmp-type: all
+- target: ACCEPT pings
+  proto: icmp
+  icmp-type: !not 8
+'''))
+    assert 'no icmp at all' not in script
+    assert 'ip protocol icmp accept comment "Accept any icmp"' in script
+    assert 'icmp type != 8 accept' in script
@@ -0,0 +1,76 @@
+import io
+import save
+
+RULES = '''
+    - target: ACCEPT
+      proto: tcp
+      dport: 22
+    - target: DROP
+      saddr: 10.0.0.1
+    - target: ACCEPT
+      proto: tcp
+      dport: 80
+    - target: ACCEPT
+      proto: udp
+      dport: 53
+'''
+
+
+def counters(*rules):
+    return save.parse(io.StringIO(
+        '*filter\n'
+        ':INPUT DROP [0:0]\n'
+        + ''.join(f'[{packets}:0] -A INPUT {rule}\n'
+                  for packets, rule in rules)
+        + 'COMMIT\n'
+    ))
+
+
+def test_hot_rules_move_up(rule_lines):
+    lines = rule_lines(RULES, passes=['reorder'], counters=counters(
+        (5, '-p tcp -m tcp --dport 22 -j ACCEPT'),
+        (0, '-s 10.0.0.1/32 -j DROP'),
+        (10, '-p tcp -m tcp --dport 80 -j ACCEPT'),
+        (100, '-p udp -m udp --dport 53 -j ACCEPT'),
+    ))
+    # the udp rule moves above the tcp one, but not above the drop rule,
+    # which may match the same packets
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp --dport 22',
+        '-A INPUT -j DROP -s 10.0.0.1',
+        '-A INPUT -j ACCEPT -p udp --dport 53',
+        '-A INPUT -j ACCEPT -p tcp --dport 80',
+    ]
+
+
+def test_rules_dont_move_past_overlapping_rules(rule_lines):
+    # packets from 10.0.0.1 to port 80 are dropped, whatever the counters
+    lines = rule_lines(RULES, passes=['reorder'], counters=counters(
+        (10, '-p tcp -m tcp --dport 80 -j ACCEPT'),
+    ))
+    assert lines.index('-A INPUT -j DROP -s 10.0.0.1') < lines.index(
+        '-A INPUT -j ACCEPT -p tcp --dport 80'
+    )
+
+
+def test_no_counters_keeps_the_order(rule_lines):
+    assert rule_lines(RULES, passes=['reorder'], counters=counters()) == \
+        rule_lines(RULES)
+
+
+def test_hot_rule_moves_to_the_head(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          proto: tcp
+          dport: '{item}'
+          with_items: [22, 80, 443]
+    ''', passes=['reorder'], counters=counters(
+        (1, '-p tcp -m tcp --dport 22 -j ACCEPT'),
+        (2, '-p tcp -m tcp --dport 80 -j ACCEPT'),
+        (50, '-p tcp -m tcp --dport 443 -j ACCEPT'),
+    ))
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp --dport 443',
+        '-A INPUT -j ACCEPT -p tcp --dport 80',
+        '-A INPUT -j ACCEPT -p tcp --dport 22',
+    ]
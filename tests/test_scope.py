@@ -0,0 +1,33 @@
+def test_rule_features_dont_leak(rule_lines):
+    lines = rule_lines('''
+        - target: ACCEPT
+          iface: lo
+        - target: ACCEPT
+          proto: tcp
+        - target: DROP
+          saddr: '{item}'
+          with_items: [10.0.0.1]
+        - target: DROP
+          proto: udp
+    ''')
+    assert lines == [
+        '-A INPUT -j ACCEPT -i lo',
+        '-A INPUT -j ACCEPT -p tcp',
+        '-A INPUT -j DROP -s 10.0.0.1',
+        '-A INPUT -j DROP -p udp',
+    ]
+
+
+def test_block_rule_features_are_kept(rule_lines):
+    lines = rule_lines('''
+        - block:
+            !rule iface: eth0
+          rules:
+            - target: ACCEPT
+              proto: tcp
+            - target: DROP
+    ''')
+    assert lines == [
+        '-A INPUT -j ACCEPT -p tcp -i eth0',
+        '-A INPUT -j DROP -i eth0',
+    ]
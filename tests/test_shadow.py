@@ -0,0 +1,50 @@
+import logging
+
+SHADOWED = '''
+    - target: DROP
+      saddr: 10.0.0.0/8
+    - target: ACCEPT
+      saddr: 10.1.0.0/16
+      proto: tcp
+    - target: ACCEPT
+      saddr: 192.168.0.0/16
+'''
+
+
+def test_shadowed_rule_is_dropped(rule_lines, caplog):
+    with caplog.at_level(logging.WARNING):
+        lines = rule_lines(SHADOWED, passes=['shadow'])
+    assert lines == [
+        '-A INPUT -j DROP -s 10.0.0.0/8',
+        '-A INPUT -j ACCEPT -s 192.168.0.0/16',
+    ]
+    assert 'rule never matches' in caplog.text
+
+
+def test_keep_shadowed(rule_lines, caplog):
+    with caplog.at_level(logging.WARNING):
+        lines = rule_lines(SHADOWED, passes=['shadow'], keep_shadowed=True)
+    assert lines == rule_lines(SHADOWED)
+    assert 'rule never matches' in caplog.text
+
+
+def test_partial_overlap_is_kept(rule_lines):
+    # only the tcp packets of 10.1.0.0/16 are dropped first
+    text = '''
+        - target: DROP
+          saddr: 10.0.0.0/8
+          proto: tcp
+        - target: ACCEPT
+          saddr: 10.1.0.0/16
+    '''
+    assert rule_lines(text, passes=['shadow']) == rule_lines(text)
+
+
+def test_non_terminal_rules_dont_shadow(rule_lines):
+    text = '''
+        - target: USER
+          saddr: 10.0.0.0/8
+        - target: ACCEPT
+          saddr: 10.1.0.0/16
+    '''
+    assert rule_lines(text, passes=['shadow']) == rule_lines(text)
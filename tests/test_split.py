@@ -0,0 +1,58 @@
+import textwrap
+
+from conftest import FILTER
+
+
+def networks(count):
+    return f'''
+        - target: ACCEPT
+          saddr: '10.0.{{item}}.0/24'
+          with_items: {list(range(count))}
+        - target: DROP
+          proto: tcp
+    '''
+
+
+def test_long_runs_become_a_jump_tree(rule_lines):
+    lines = rule_lines(networks(16), passes=['split'])
+    assert [line for line in lines if line.startswith('-A INPUT ')] == [
+        '-A INPUT -j INPUT-1 -s 10.0.0.0/21',
+        '-A INPUT -j INPUT-4 -s 10.0.8.0/21',
+        '-A INPUT -j DROP -p tcp',
+    ]
+    assert [line for line in lines if line.startswith('-A INPUT-1 ')] == [
+        '-A INPUT-1 -j INPUT-2 -s 10.0.0.0/22',
+        '-A INPUT-1 -j INPUT-3 -s 10.0.4.0/22',
+    ]
+    # each rule is kept once, in a leaf chain
+    leaves = [line for line in lines if '-j ACCEPT' in line]
+    assert [line.split()[-1] for line in leaves] == [
+        f'10.0.{i}.0/24' for i in range(16)
+    ]
+    assert leaves[4] == '-A INPUT-3 -j ACCEPT -s 10.0.4.0/24'
+
+
+def test_chains_are_declared(make_yip):
+    yip = make_yip(FILTER + textwrap.indent(networks(16), ' ' * 4),
+                   passes=['split'])
+    assert ':INPUT-6 - [0:0]' in yip.render()
+
+
+def test_short_runs_are_kept(rule_lines):
+    assert rule_lines(networks(15), passes=['split']) == \
+        rule_lines(networks(15))
+
+
+def test_overlapping_networks_are_kept(rule_lines):
+    # the /16 overlaps the /24s on both sides and cuts the run in two
+    text = '''
+        - target: ACCEPT
+          saddr: '10.0.{item}.0/24'
+          with_items: [0, 1, 2, 3, 4, 5, 6, 7]
+        - target: ACCEPT
+          saddr: 10.0.0.0/16
+        - target: ACCEPT
+          saddr: '10.0.{item}.0/24'
+          with_items: [8, 9, 10, 11, 12, 13, 14, 15]
+    '''
+    assert rule_lines(text, passes=['split']) == rule_lines(text)
@@ -0,0 +1,49 @@
+import os
+
+from loader import ImportTable
+from watch import Watcher
+from yiptable import Yip
+
+MAIN = '''\
+filter:
+  chains:
+    INPUT: {policy}
+  rules: !import rules.yml
+'''
+
+RULES = '''\
+- chain: INPUT
+  target: ACCEPT
+  proto: tcp
+'''
+
+
+def test_root_reload_keeps_the_imports(tmp_path, monkeypatch):
+    main = tmp_path / 'main.yml'
+    main.write_text(MAIN.format(policy='DROP'))
+    (tmp_path / 'rules.yml').write_text(RULES)
+
+    parsed = []
+    parse = ImportTable.parse
+
+    def record(self, filename):
+        parsed.append(os.path.basename(filename))
+        return parse(self, filename)
+
+    monkeypatch.setattr(ImportTable, 'parse', record)
+    outputs = []
+    watcher = Watcher(
+        str(main), lambda imports: Yip(str(main), imports=imports),
+        lambda yip, live: outputs.append(yip.render()),
+    )
+    watcher.update([watcher.path])
+    watcher.output()
+    assert parsed == ['main.yml', 'rules.yml']
+
+    main.write_text(MAIN.format(policy='ACCEPT'))
+    os.utime(main, ns=(0, 1))
+    watcher.update(watcher.changed())
+    watcher.output()
+    assert parsed == ['main.yml', 'rules.yml', 'main.yml']
+    assert ':INPUT ACCEPT' in outputs[-1]
+    assert '-A INPUT -j ACCEPT -p tcp' in outputs[-1]
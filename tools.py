@@ -14,34 +14,105 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
 import re
+from string import Formatter
 from meta import YipSyntaxError
 
 simple_format = re.compile(r'^{([^{} \t()\*\\=/%+-]+)}$')
 
 
 def yip_stringize(e):
-    if not any(map(lambda x: isinstance(e, x), (int, str))):
+    if not isinstance(e, (int, str)):
         raise YipSyntaxError(e, f'Element is not a string: {e}')
     return str(e)
 
 
-def yip_get_single_var(scope, string):
-    if not isinstance(string, str):
-        return None
-    match = re.match(simple_format, string)
-    if match:
-        vname = match.group(1)
+class FormatTemplate():
+    def __init__(self, string):
+        match = re.match(simple_format, string)
+        self.single = match.group(1) if match else None
+        self.string = str.__str__(string)
+        # (literal, field name, conversion, format spec) parts
+        self.parts = []
+        self.fast = True
+        for literal, field, spec, conv in _formatter.parse(string):
+            if field is None:
+                self.parts.append((literal, None, None, None))
+                continue
+            if (not field or field.isdigit() or '.' in field or '[' in field
+                    or '{' in spec):
+                # positional, attribute or item fields, nested specs
+                self.fast = False
+            self.parts.append((literal, field, conv, spec))
+        # variables used by the string
+        self.fields = {
+            re.split(r'[.[]', part[1], 1)[0]
+            for part in self.parts if part[1]
+        }
+
+    def lookup(self, scope, string):
+        vname = self.single
         lookup_res = scope.get(vname)
         if lookup_res is None:
             raise YipSyntaxError(string, f'Undefined variable `{vname}`')
         return lookup_res
-    return None
+
+    def render(self, scope):
+        if not self.fast:
+            return self.string.format(
+                **{f: scope[f] for f in self.fields if f in scope}
+            )
+        res = []
+        for literal, field, conv, spec in self.parts:
+            res.append(literal)
+            if field is not None:
+                value = scope[field]
+                if conv:
+                    value = _conversions[conv](value)
+                res.append(format(value, spec))
+        return ''.join(res)
+
+
+_formatter = Formatter()
+
+_conversions = {'s': str, 'r': repr, 'a': ascii}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def yip_template(string):
+    return FormatTemplate(string)
+
+
+def yip_get_single_var(scope, string):
+    if not isinstance(string, str) or '{' not in string:
+        return None
+    template = yip_template(string)
+    if template.single is None:
+        return None
+    return template.lookup(scope, string)
 
 
 def yip_str_format(scope, string):
-    res = yip_get_single_var(scope, string)
-    return res if res else string.format(**scope)
+    if '{' not in string and '}' not in string:
+        return string
+    template = yip_template(string)
+    if template.single is not None:
+        res = template.lookup(scope, string)
+        if res:
+            return res
+    return template.render(scope)
+
+
+# variables used when formatting e
+def yip_format_fields(e):
+    if isinstance(e, dict):
+        return set().union(*map(yip_format_fields, e.values()))
+    elif isinstance(e, list):
+        return set().union(*map(yip_format_fields, e))
+    elif isinstance(e, str) and ('{' in e or '}' in e):
+        return yip_template(e).fields
+    return set()
 
 
 def yip_dict_format(scope, d):
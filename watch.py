@@ -0,0 +1,146 @@
+# Yiptables, a yaml to iptables-restore tranpiler
+# Copyright (C) 2017 Victor Collod <victor.collod@prologin.org>
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import save
+from yaml import YAMLError
+from cache import read_source
+from meta import YipSyntaxError
+
+
+def reaches(node, tree):
+    if node is tree:
+        return True
+    if isinstance(node, dict):
+        return any(reaches(v, tree) for v in node.values())
+    if isinstance(node, list):
+        return any(reaches(v, tree) for v in node)
+    return False
+
+
+# keeps a compiled ruleset in memory, and compiles it again whenever one of
+# the files it was loaded from changes. Only the changed files are parsed
+# again, and only the tables importing them are rebuilt. When given the live
+# ruleset, each output is a delta against the previous one.
+class Watcher():
+    def __init__(self, path, make_yip, emit, live=None, interval=0.5):
+        self.path = os.path.abspath(path)
+        self.make_yip = make_yip
+        self.emit = emit
+        self.live = live
+        self.interval = interval
+        self.yip = None
+        # kept across reloads of the root file, so that the unchanged
+        # imports aren't parsed again
+        self.imports = None
+        # tables which failed to build
+        self.dirty = set()
+        # path -> (mtime, digest) of the watched files
+        self.files = {}
+
+    def stat(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, deps):
+        for path, fdigest in deps:
+            self.files[path] = (self.stat(path), fdigest)
+
+    def changed(self):
+        res = []
+        for path, (mtime, fdigest) in list(self.files.items()):
+            nmtime = self.stat(path)
+            if nmtime is None or nmtime == mtime:
+                continue
+            try:
+                ndigest = read_source(path)[1]
+            except OSError:
+                continue
+            self.files[path] = (nmtime, ndigest)
+            if ndigest != fdigest:
+                res.append(path)
+        return res
+
+    def report(self, msg):
+        print(msg, file=sys.stderr)
+
+    def output(self):
+        self.emit(self.yip, self.live)
+        if self.live is not None:
+            self.live = save.parse(self.yip.render_lines())
+
+    def load(self):
+        self.yip = None
+        if self.path not in self.files:
+            self.files[self.path] = (self.stat(self.path), None)
+        yip = self.make_yip(self.imports)
+        self.imports = yip.imports
+        self.watch(yip.deps)
+        yip._build()
+        self.yip = yip
+        self.dirty = set()
+
+    def update(self, paths):
+        if self.yip is None or self.path in paths:
+            self.load()
+            return list(self.yip.tables)
+
+        # if this update fails halfway, rebuild everything on the next one
+        dirty = self.dirty
+        self.dirty = set(self.yip.tables)
+        trees = []
+        for path in paths:
+            entry = self.yip.imports.reload(path)
+            if entry is None:
+                self.load()
+                return list(self.yip.tables)
+            trees.append(entry[0])
+            self.watch(entry[1])
+
+        tree = self.yip.tree
+        global_vars = any(reaches(tree.get('vars'), t) for t in trees)
+        names = [
+            name for name in self.yip.tables
+            if global_vars or name in dirty
+            or any(reaches(tree[name], t) for t in trees)
+        ]
+        self.yip.rebuild(names, global_vars)
+        self.dirty = set()
+        return names
+
+    def step(self, paths):
+        start = time.perf_counter()
+        try:
+            names = self.update(paths)
+            self.output()
+        except (YipSyntaxError, YAMLError, OSError) as e:
+            self.report(str(e))
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        self.report(f'rebuilt {", ".join(names) or "nothing"} '
+                    f'in {elapsed:.1f}ms')
+
+    def run(self):
+        self.step([self.path])
+        while True:
+            time.sleep(self.interval)
+            paths = self.changed()
+            if paths:
+                self.step(paths)
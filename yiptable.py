@@ -16,40 +16,314 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
-from loader import YipLoader
+import contextlib
+import cProfile
+import delta
+import nft
+import os
+import pstats
+import save
+import sys
+import watch
+from concurrent.futures import ProcessPoolExecutor
+from cache import ParseCache, default_cache_dir
+from loader import ImportTable
 from table import default_tables
+from passes import pass_map, IpsetPass
+from profiling import Timings
 from scope import Scope, YipScope
 from meta import BaseMeta, meta, YipSyntaxError
 
 _default_chains = ('ACCEPT', 'DROP', 'RETURN')
 
+_worker_yip = None
+
+
+def _init_worker(yip):
+    global _worker_yip
+    _worker_yip = yip
+
+
+def _build_worker(name):
+    table = _worker_yip.build_table(name)
+    rendered = '\n'.join(_worker_yip.table_lines(table))
+    return BuiltTable(name, rendered, table.ipsets)
+
+
+_worker_batch = None
+
+
+def _init_batch(batch):
+    global _worker_batch
+    _worker_batch = batch
+
+
+def _compile_host(host):
+    return host, _worker_batch.compile_host(host)
+
+
+# table built and rendered by a worker process, with the backend of the Yip
+class BuiltTable():
+    def __init__(self, name, rendered, ipsets):
+        self.name = name
+        self.rendered = rendered
+        self.ipsets = ipsets
+
+    def render_lines(self):
+        return iter(self.rendered.split('\n'))
+
+    def render(self):
+        return self.rendered
+
 
 class Yip(BaseMeta):
     def __meta__(self):
         return meta(self.tree)
 
-    def __init__(self, path, default_chains=_default_chains):
-        self.scope = YipScope()
+    def __init__(self, path, default_chains=_default_chains, passes=(),
+                 counters=None, cache=None, jobs=None, timings=None,
+                 compact=False, lazy=False, keep_shadowed=False,
+                 backend='iptables', defines=None, imports=None):
+        if lazy and passes:
+            raise ValueError('optimization passes need the whole ruleset, '
+                             'they can\'t run on lazy builds')
+        if backend == 'nft' and (lazy or compact):
+            raise ValueError('the nft backend needs the built rules, it '
+                             'can\'t run on lazy or compact builds')
+        # variables taking precedence over the ones of the file
+        self.defines = {} if defines is None else defines
+        self.scope = self.global_scope()
         self.path = path
-        self.tree = YipLoader.load(open(path))
+        self.passes = passes
+        self.jobs = jobs
+        self.timings = timings
+        self.compact = compact
+        self.lazy = lazy
+        self.keep_shadowed = keep_shadowed
+        self.backend = backend
+        self.counters = {} if counters is None else counters
+        if imports is None:
+            imports = ImportTable(cache, timings=timings)
+        self.imports = imports
+        with self.measure('phase', 'load'):
+            self.tree, self.deps = self.imports.load(path)
         self.tables = {}
         self.chains = Scope({c: None for c in _default_chains})
         self.built = False
 
+    def global_scope(self):
+        return YipScope(dict(self.defines), fixed=self.defines)
+
+    def measure(self, category, name):
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.measure(category, name)
+
+    def build_table(self, name):
+        with self.measure('table', name):
+            table = default_tables[name](self, name)
+            table.build(self.tree[name], lazy=self.lazy)
+            table.optimize(self.passes)
+            if self.compact:
+                table.compact_rules()
+        return table
+
+    def _build_parallel(self, names):
+        with ProcessPoolExecutor(
+            max_workers=min(self.jobs, len(names)),
+            initializer=_init_worker,
+            initargs=(self,),
+        ) as executor:
+            for table in executor.map(_build_worker, names):
+                self.tables[table.name] = table
+
     def _build(self):
-        self.scope.get_vars(self.tree)
-        for table, table_class in default_tables.items():
-            tnode = self.tree.get(table)
-            if tnode:
-                nt = table_class(self, table)
-                self.tables[table] = nt
-                nt.build(tnode)
+        with self.measure('phase', 'vars'):
+            self.scope.get_vars(self.tree)
+        names = [t for t in default_tables if self.tree.get(t)]
+        # workers can't report timings, build sequentially when profiling.
+        # Lazy tables are built while rendered, in this process.
+        parallel = self.jobs and self.jobs > 1
+        parallel = parallel and self.timings is None and not self.lazy
+        with self.measure('phase', 'build'):
+            if parallel and len(names) > 1:
+                self._build_parallel(names)
+            else:
+                for name in names:
+                    self.tables[name] = self.build_table(name)
         self.built = True
 
+    # build the given tables again after their source changed, along with
+    # the global variables
+    def rebuild(self, names, global_vars=False):
+        if global_vars:
+            self.scope = self.global_scope()
+            with self.measure('phase', 'vars'):
+                self.scope.get_vars(self.tree)
+        with self.measure('phase', 'build'):
+            for name in names:
+                self.tables[name] = self.build_table(name)
+
+    def table_lines(self, table):
+        if self.backend == 'nft' and not isinstance(table, BuiltTable):
+            return nft.table_lines(table)
+        return table.render_lines()
+
+    def render_lines(self):
+        if not self.built:
+            self._build()
+        with self.measure('phase', 'render'):
+            if self.backend == 'nft':
+                yield from nft.header_lines()
+            for i, table in enumerate(self.tables.values()):
+                if i:
+                    yield ''
+                    yield ''
+                yield from self.table_lines(table)
+
+    def render_to(self, fp):
+        fp.writelines(line + '\n' for line in self.render_lines())
+
     def render(self):
+        return '\n'.join(self.render_lines())
+
+    def render_delta_lines(self, live):
         if not self.built:
             self._build()
-        return '\n\n\n'.join(o.render() for n, o in self.tables.items())
+        return delta.delta_lines(self, live)
+
+    def render_ipsets(self):
+        if not self.built:
+            self._build()
+        return '\n'.join(
+            line
+            for table in self.tables.values()
+            for line in IpsetPass.render_sets(table.ipsets)
+        )
+
+
+# compiles the ruleset of each host of an inventory, which maps host names
+# to the variables they define. The source files are parsed once, and the
+# hosts are built from the same trees, in worker processes if asked to.
+class Batch():
+    def __init__(self, path, inventory, output_dir='.', jobs=None,
+                 defines=None, cache=None, **options):
+        self.path = path
+        self.output_dir = output_dir
+        self.jobs = jobs
+        self.options = options
+        self.imports = ImportTable(cache)
+        self.imports.load(path)
+        self.hosts = self.load_inventory(inventory, defines or {})
+
+    def load_inventory(self, inventory, defines):
+        tree = self.imports.load(inventory)[0]
+        if not isinstance(tree, dict):
+            raise YipSyntaxError(tree, 'The inventory must map host names '
+                                 'to their variables')
+        hosts = {}
+        for host, hvars in tree.items():
+            if not host or '/' in host or host.startswith('.'):
+                raise YipSyntaxError(host, f'Invalid host name: `{host}`')
+            if not hvars:
+                hvars = {}
+            elif not isinstance(hvars, dict):
+                raise YipSyntaxError(hvars, 'The variables of a host must '
+                                     'be a dict')
+            hosts[str.__str__(host)] = {
+                **defines,
+                **{k: '' if v is None else v for k, v in hvars.items()},
+            }
+        return hosts
+
+    def host_path(self, host, suffix):
+        return os.path.join(self.output_dir, host + suffix)
+
+    # returns the error message of a failed build
+    def compile_host(self, host):
+        try:
+            yip = Yip(self.path, imports=self.imports,
+                      defines=self.hosts[host], **self.options)
+            nft_backend = yip.backend == 'nft'
+            suffix = '.nft' if nft_backend else '.rules'
+            write_lines(self.host_path(host, suffix), yip.render_lines())
+            if 'ipset' in yip.passes and not nft_backend:
+                write_lines(self.host_path(host, '.ipset'),
+                            [yip.render_ipsets()])
+        except (YipSyntaxError, OSError) as e:
+            return str(e)
+        return None
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.jobs and self.jobs > 1 and len(self.hosts) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(self.jobs, len(self.hosts)),
+                initializer=_init_batch,
+                initargs=(self,),
+            ) as executor:
+                yield from executor.map(_compile_host, self.hosts)
+        else:
+            for host in self.hosts:
+                yield host, self.compile_host(host)
+
+
+def yip_options(args):
+    counters = save.load(args.counters) if args.counters else None
+    cache = ParseCache(args.cache) if args.cache else None
+    defines = dict(d.partition('=')[::2] for d in args.define)
+    return dict(passes=args.optimize, counters=counters, cache=cache,
+                compact=args.compact, lazy=args.lazy,
+                keep_shadowed=args.keep_shadowed, backend=args.backend,
+                defines=defines)
+
+
+def make_yip(args, timings=None, imports=None):
+    return Yip(args.firewall, jobs=args.jobs, timings=timings,
+               imports=imports, **yip_options(args))
+
+
+def compile_batch(args):
+    batch = Batch(args.firewall, args.inventory, args.output_dir,
+                  jobs=args.jobs, **yip_options(args))
+    failed = False
+    for host, error in batch.run():
+        if error is not None:
+            print(f'{host}: {error}', file=sys.stderr)
+            failed = True
+    return not failed
+
+
+# the file is replaced once complete, so that a failed build doesn't leave
+# a truncated ruleset behind
+def write_lines(path, lines):
+    tmp = path + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def write_ruleset(args, yip, live=None):
+    if live is not None:
+        lines = yip.render_delta_lines(live)
+    else:
+        lines = yip.render_lines()
+    if args.output:
+        write_lines(args.output, lines)
+    else:
+        sys.stdout.writelines(line + '\n' for line in lines)
+        sys.stdout.flush()
+    if args.ipset_output:
+        write_lines(args.ipset_output, [yip.render_ipsets()])
+
+
+def compile_ruleset(args, timings=None):
+    yip = make_yip(args, timings)
+    write_ruleset(args, yip, save.load(args.delta) if args.delta else None)
 
 
 if __name__ == '__main__':
@@ -58,7 +332,111 @@ if __name__ == '__main__':
     options = Options()
     parser = argparse.ArgumentParser()
     parser.add_argument('firewall', help='source file')
+    parser.add_argument('-D', '--define', action='append', default=[],
+                        metavar='NAME[=VALUE]',
+                        help='define a variable, overriding the one of the '
+                        'source files')
+    parser.add_argument('--inventory', metavar='FILE',
+                        help='compile the ruleset of each host of FILE, '
+                        'which maps host names to their variables')
+    parser.add_argument('--output-dir', metavar='DIR', default='.',
+                        help='write the rulesets of the inventory hosts to '
+                        'DIR (default: .)')
+    parser.add_argument('--backend', choices=('iptables', 'nft'),
+                        default='iptables',
+                        help='output an iptables-restore or an nft -f script '
+                        '(default: iptables)')
+    parser.add_argument('-O', '--optimize', action='append', default=[],
+                        choices=pass_map, help='enable an optimization pass')
+    parser.add_argument('--keep-shadowed', action='store_true',
+                        help='only report the rules found by the shadow '
+                        'pass, without dropping them')
+    parser.add_argument('--ipset-output', metavar='FILE',
+                        help='write the ipset restore script to FILE')
+    parser.add_argument('--counters', metavar='FILE',
+                        help='iptables-save -c dump used by the reorder pass')
+    parser.add_argument('--cache', metavar='DIR', nargs='?',
+                        const=default_cache_dir(),
+                        help='cache parsed files in DIR '
+                        f'(default: {default_cache_dir()})')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the ruleset to FILE instead of stdout')
+    parser.add_argument('--delta', metavar='FILE',
+                        help='only output the chains which differ from the '
+                        'iptables-save dump in FILE, as an '
+                        'iptables-restore --noflush script')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+                        help='build tables in N worker processes')
+    parser.add_argument('--compact', action='store_true',
+                        help='only keep the rendered rules in memory, '
+                        'for large rulesets')
+    parser.add_argument('--lazy', action='store_true',
+                        help='build each rule while rendering it, without '
+                        'keeping the ruleset in memory')
+    parser.add_argument('--watch', metavar='SECONDS', type=float, nargs='?',
+                        const=0.5,
+                        help='keep running, and compile the ruleset again '
+                        'when its files change, checking them every SECONDS '
+                        '(default: 0.5)')
+    parser.add_argument('--timings', action='store_true',
+                        help='report the time spent in each imported file, '
+                        'table, feature and hot path on stderr')
+    parser.add_argument('--profile', action='store_true',
+                        help='report a cProfile summary on stderr')
+    args = parser.parse_args()
+    nft_backend = args.backend == 'nft'
+    ipset_output = args.ipset_output or args.inventory or nft_backend
+    if 'ipset' in args.optimize and not ipset_output:
+        parser.error('the ipset pass requires --ipset-output')
+    if 'reorder' in args.optimize and not args.counters:
+        parser.error('the reorder pass requires --counters')
+    if args.lazy and args.optimize:
+        parser.error('optimization passes can\'t run with --lazy')
+    if nft_backend and (args.lazy or args.compact or args.delta):
+        parser.error('the nft backend can\'t run with --lazy, --compact '
+                     'or --delta')
+    if args.lazy and args.watch:
+        parser.error('--watch keeps the ruleset in memory, it can\'t run '
+                     'with --lazy')
+    if args.inventory and (args.watch or args.delta or args.output
+                           or args.ipset_output):
+        parser.error('--inventory writes one file per host to --output-dir, '
+                     'it can\'t run with --watch, --delta, -o or '
+                     '--ipset-output')
+    if args.inventory:
+        try:
+            sys.exit(0 if compile_batch(args) else 1)
+        except YipSyntaxError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
+    if args.watch:
+        live = save.load(args.delta) if args.delta else None
+        watcher = watch.Watcher(
+            args.firewall,
+            lambda imports: make_yip(args, imports=imports),
+            lambda yip, live: write_ruleset(args, yip, live),
+            live,
+            args.watch,
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    timings = Timings() if args.timings else None
+    profile = cProfile.Profile() if args.profile else None
+    failed = False
     try:
-        print(Yip(parser.parse_args().firewall).render())
+        with timings or contextlib.nullcontext():
+            with profile or contextlib.nullcontext():
+                compile_ruleset(args, timings)
     except YipSyntaxError as e:
         print(str(e))
+        failed = True
+    if timings:
+        print('\n'.join(timings.report()), file=sys.stderr)
+    if profile:
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(40)
+    if failed:
+        sys.exit(1)